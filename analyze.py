@@ -1,16 +1,11 @@
-from collections import Counter
+# prints how many times each ratio was played, see pythagoras/analytics.py for the whole report
+import os
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pythagoras"))
+from analytics import analyze_log
 
-def get_ratios():
-    with open("ratios.csv") as file:
-        for line in file:
-            for elem in line.split(",")[2:]:
-                if int(elem) != 0:
-                    yield int(elem)
-
-
-counts = Counter(get_ratios())
-counts_list = list(counts.items())
-counts_list.sort(key=lambda i: i[1])  # , reverse=True)
-for pair in counts_list:
-    print(pair)
+counts = analyze_log("ratios.csv").ratio_counts
+# the least played first, so the most played end up at the bottom, ties by ratio
+for ratio in sorted(counts.nonzero()[0], key=lambda ratio: (counts[ratio], ratio)):  # , reverse=True)
+    print((int(ratio), int(counts[ratio])))
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+import argparse
+import multiprocessing
+import os
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from lattice import decompose_into_small_primes
+from session_log import binary_dtype, kinds, load_binary_log
+
+# ratios in the log are numbers from 0 (empty slot) to 99
+max_ratio = 100
+num_slots = 10
+# time, kind and the slots
+num_columns = 2 + num_slots
+recorded_kinds = [kinds.index("node"), kinds.index("edge")]
+
+
+class LogStats:
+    """Statistics of a session log, which can be computed for parts of the log and then merged.
+
+    - ratio_counts[n] - how many times n was played, in any slot
+    - cooccurrence[a, b] - in how many rows a and b were played together
+    - kind_counts and kind_transitions[kind1, kind2] - of consecutive rows
+    - changed_notes[k] - how many times k notes changed between consecutive
+      recorded (node or edge) chords
+    - recorded_gaps - total seconds between consecutive recorded chords
+    """
+
+    def __init__(self):
+        self.num_rows = 0
+        self.ratio_counts = np.zeros(max_ratio, dtype=np.int64)
+        self.cooccurrence = np.zeros((max_ratio, max_ratio), dtype=np.int64)
+        self.kind_counts = np.zeros(len(kinds), dtype=np.int64)
+        self.kind_transitions = np.zeros((len(kinds), len(kinds)), dtype=np.int64)
+        self.changed_notes = np.zeros(2 * num_slots + 1, dtype=np.int64)
+        self.recorded_gaps = 0.0
+        # needed for the transitions between the merged parts
+        self.first = self.last = None
+        self.first_recorded = self.last_recorded = None
+        self.start_time = self.end_time = None
+
+    @classmethod
+    def from_rows(cls, times, row_kinds, ratios):
+        stats = cls()
+        stats.num_rows = len(times)
+        if stats.num_rows == 0:
+            return stats
+        ratios = ratios.astype(np.intp)
+        stats.ratio_counts = np.bincount(ratios.ravel(), minlength=max_ratio)
+        stats.ratio_counts[0] = 0
+        # which numbers each row has, float32 is exact up to 2**24 rows and uses BLAS
+        presence = np.zeros((len(ratios), max_ratio), dtype=np.float32)
+        presence[np.arange(len(ratios))[:, None], ratios] = 1
+        presence[:, 0] = 0
+        stats.cooccurrence = (presence.T @ presence).astype(np.int64)
+
+        stats.kind_counts = np.bincount(row_kinds, minlength=len(kinds))
+        transitions = row_kinds[:-1].astype(np.intp) * len(kinds) + row_kinds[1:]
+        stats.kind_transitions = np.bincount(transitions, minlength=len(kinds) ** 2).reshape(len(kinds), len(kinds))
+
+        recorded = np.isin(row_kinds, recorded_kinds)
+        recorded_presence = presence[recorded] != 0
+        changed = (recorded_presence[1:] != recorded_presence[:-1]).sum(axis=1)
+        stats.changed_notes = np.bincount(changed, minlength=2 * num_slots + 1)
+        recorded_times = times[recorded]
+        stats.recorded_gaps = float(np.diff(recorded_times).sum())
+
+        stats.first = row_kinds[0]
+        stats.last = row_kinds[-1]
+        if recorded.any():
+            stats.first_recorded = (recorded_times[0], recorded_presence[0])
+            stats.last_recorded = (recorded_times[-1], recorded_presence[-1])
+        stats.start_time, stats.end_time = times[0], times[-1]
+        return stats
+
+    def merge(self, other):
+        """Add the stats of the part of the log which comes right after this one."""
+        if other.num_rows == 0:
+            return self
+        if self.num_rows == 0:
+            return other
+        self.num_rows += other.num_rows
+        self.ratio_counts += other.ratio_counts
+        self.cooccurrence += other.cooccurrence
+        self.kind_counts += other.kind_counts
+        self.kind_transitions += other.kind_transitions
+        self.changed_notes += other.changed_notes
+        self.recorded_gaps += other.recorded_gaps
+        # ! the transitions across the border
+        self.kind_transitions[self.last, other.first] += 1
+        if self.last_recorded is not None and other.first_recorded is not None:
+            time1, presence1 = self.last_recorded
+            time2, presence2 = other.first_recorded
+            self.changed_notes[(presence1 != presence2).sum()] += 1
+            self.recorded_gaps += time2 - time1
+        self.last = other.last
+        if self.first_recorded is None:
+            self.first_recorded = other.first_recorded
+        if other.last_recorded is not None:
+            self.last_recorded = other.last_recorded
+        self.end_time = other.end_time
+        return self
+
+    def prime_usage(self, primes=[2, 3, 5, 7]):
+        """How often each exponent of each prime was played.
+
+        Returns (usage, undecomposable): usage[i, e] counts the numbers played
+        with prime i in power e, and undecomposable counts the numbers which
+        aren't made of these primes.
+        """
+        exponents = np.zeros((max_ratio, len(primes)), dtype=np.int64)
+        decomposable = np.zeros(max_ratio, dtype=bool)
+        for n in range(1, max_ratio):
+            factors = decompose_into_small_primes(n, primes)
+            if factors is not None:
+                exponents[n] = factors
+                decomposable[n] = True
+        usage = np.zeros((len(primes), exponents.max() + 1), dtype=np.int64)
+        for i in range(len(primes)):
+            np.add.at(usage[i], exponents[decomposable, i], self.ratio_counts[decomposable])
+        undecomposable = self.ratio_counts[~decomposable].sum()
+        return usage, undecomposable
+
+
+# ! reading the logs
+
+
+_max_digits = 30
+_powers_of_10 = 10.0 ** np.arange(-_max_digits, _max_digits)
+
+
+def parse_csv_chunk(chunk):
+    """Rows of a CSV session log, given as bytes with whole lines.
+
+    Parses all the numbers at once: each digit adds digit * 10**k to its field,
+    with k from its distance to the decimal point. Returns (times, kinds, ratios).
+    """
+    buf = np.frombuffer(chunk.replace(b"\r", b""), dtype=np.uint8)
+    if len(buf) and buf[-1] != ord("\n"):
+        buf = np.append(buf, np.uint8(ord("\n")))
+    is_separator = (buf == ord(",")) | (buf == ord("\n"))
+    field_ends = np.flatnonzero(is_separator)
+    num_fields = len(field_ends)
+    if num_fields % num_columns != 0:
+        raise ValueError(f"every row of the log must have {num_columns} fields")
+    field_starts = np.concatenate([[0], field_ends[:-1] + 1])
+    # field index of every byte - the separator belongs to the field it ends
+    byte_fields = np.zeros(len(buf), dtype=np.int32)
+    np.cumsum(is_separator[:-1], dtype=np.int32, out=byte_fields[1:])
+
+    # the decimal point of every field, or its end if it has none
+    points = field_ends.astype(np.int32)
+    dots = np.flatnonzero(buf == ord("."))
+    points[byte_fields[dots]] = dots
+    digits = buf - np.uint8(ord("0"))
+    digit_positions = np.flatnonzero(digits < 10).astype(np.int32)
+    digit_fields = byte_fields[digit_positions]
+    # digits before the point are 10**0, 10**1... and after it 10**-1, 10**-2...
+    distances = points[digit_fields] - digit_positions
+    distances -= distances > 0
+    values = np.bincount(
+        digit_fields,
+        weights=digits[digit_positions] * _powers_of_10[distances + _max_digits],
+        minlength=num_fields,
+    ).reshape(-1, num_columns)
+
+    # kinds are told apart by their first letter
+    kind_codes = np.zeros(256, dtype=np.uint8)
+    for i, kind in enumerate(kinds):
+        kind_codes[ord(kind[0])] = i
+    row_kinds = kind_codes[buf[field_starts[1::num_columns]]]
+    return values[:, 0], row_kinds, np.rint(values[:, 2:]).astype(np.uint8)
+
+
+def split_csv(path, num_parts):
+    """Byte ranges which split the file into about equal parts, at line ends."""
+    size = os.path.getsize(path)
+    borders = [0]
+    with open(path, "rb") as f:
+        for i in range(1, num_parts):
+            f.seek(max(size * i // num_parts, borders[-1]))
+            f.readline()
+            borders.append(min(f.tell(), size))
+    borders.append(size)
+    return [(start, end) for start, end in zip(borders[:-1], borders[1:]) if start < end]
+
+
+def read_csv_range(path, start, end, chunk_bytes=2**22):
+    """Rows of the CSV log between two line ends, in chunks of (times, kinds, ratios)."""
+    rest = b""
+    with open(path, "rb") as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            data = rest + f.read(min(chunk_bytes, end - position))
+            position += len(data) - len(rest)
+            # * only whole lines, the rest waits for the next chunk
+            cut = data.rfind(b"\n") + 1 if position < end else len(data)
+            chunk, rest = data[:cut], data[cut:]
+            if chunk.strip():
+                yield parse_csv_chunk(chunk)
+
+
+def read_binary_range(path, start, end, chunk_rows=2**18):
+    """Rows of the binary log from start to end, in chunks of (times, kinds, ratios)."""
+    rows = load_binary_log(path)
+    for chunk_start in range(start, end, chunk_rows):
+        chunk = rows[chunk_start : min(chunk_start + chunk_rows, end)]
+        yield chunk["time"], chunk["kind"], chunk["ratios"]
+
+
+def read_log(path, chunk_bytes=2**22):
+    """All rows of a session log, in chunks of (times, kinds, ratios)."""
+    if path.endswith(".csv"):
+        return read_csv_range(path, 0, os.path.getsize(path), chunk_bytes)
+    num_rows = os.path.getsize(path) // binary_dtype.itemsize
+    return read_binary_range(path, 0, num_rows, max(chunk_bytes // binary_dtype.itemsize, 1))
+
+
+def _analyze_csv_range(job):
+    stats = LogStats()
+    for rows in read_csv_range(*job):
+        stats = stats.merge(LogStats.from_rows(*rows))
+    return stats
+
+
+def _analyze_binary_range(job):
+    stats = LogStats()
+    for rows in read_binary_range(*job):
+        stats = stats.merge(LogStats.from_rows(*rows))
+    return stats
+
+
+def analyze_log(path, jobs=1, chunk_bytes=2**22):
+    """Stats of a session log - ratios.csv, or a binary one written with --log-format binary.
+
+    The log is read in chunks of about chunk_bytes. With jobs > 1, parts of
+    the log are analyzed in parallel processes, and their stats merged.
+    """
+    if path.endswith(".csv"):
+        ranges = split_csv(path, jobs)
+        job_list = [(path, start, end, chunk_bytes) for start, end in ranges]
+        analyze_range = _analyze_csv_range
+    else:
+        num_rows = os.path.getsize(path) // binary_dtype.itemsize
+        borders = np.linspace(0, num_rows, jobs + 1).astype(np.int64)
+        chunk_rows = max(chunk_bytes // binary_dtype.itemsize, 1)
+        job_list = [(path, start, end, chunk_rows) for start, end in zip(borders[:-1], borders[1:])]
+        analyze_range = _analyze_binary_range
+
+    stats = LogStats()
+    if jobs == 1:
+        results = map(analyze_range, job_list)
+        for part in results:
+            stats = stats.merge(part)
+        return stats
+    with multiprocessing.Pool(jobs) as pool:
+        # the parts are merged in order, to get the transitions between them
+        for part in pool.imap(analyze_range, job_list):
+            stats = stats.merge(part)
+    return stats
+
+
+def ranking(counts):
+    """Indexes of the nonzero counts, the highest count first, ties by increasing index."""
+    counts = np.asarray(counts).ravel()
+    order = np.lexsort((np.arange(len(counts)), -counts))
+    return order[counts[order] != 0]
+
+
+def print_report(stats, top=20):
+    print(f"{stats.num_rows} rows", end="")
+    if stats.num_rows:
+        print(f", {(stats.end_time - stats.start_time) / 3600:.1f} hours", end="")
+    print()
+    for kind, count in zip(kinds, stats.kind_counts):
+        print(f"{kind:>6}: {count}")
+
+    print("\nmost played numbers:")
+    for n in ranking(stats.ratio_counts)[:top]:
+        print(f"{n:>6}: {stats.ratio_counts[n]}")
+
+    print("\nmost played intervals:")
+    pairs = np.triu(stats.cooccurrence, k=1)
+    # pairs are flattened row by row, so ties are in increasing (low, high) order
+    for low, high in zip(*np.unravel_index(ranking(pairs)[:top], pairs.shape)):
+        ratio = Fraction(int(high), int(low))
+        print(f"{low:>4} {high:>4}  {ratio.numerator}:{ratio.denominator}  {pairs[low, high]}")
+
+    primes = [2, 3, 5, 7]
+    usage, undecomposable = stats.prime_usage(primes)
+    print("\nprime exponents played (exponent: count):")
+    for prime, counts in zip(primes, usage):
+        print(f"{prime:>6}: " + "  ".join(f"{e}: {count}" for e, count in enumerate(counts) if count))
+    print(f" other: {undecomposable}")
+
+    print("\ntransitions between rows (from \\ to):")
+    print("      " + "".join(f"{kind:>8}" for kind in kinds))
+    for kind, row in zip(kinds, stats.kind_transitions):
+        print(f"{kind:>6}" + "".join(f"{count:>8}" for count in row))
+    num_recorded_transitions = stats.changed_notes.sum()
+    if num_recorded_transitions:
+        print("\nbetween recorded chords:")
+        mean_changed = np.arange(len(stats.changed_notes)) @ stats.changed_notes / num_recorded_transitions
+        print(f"notes changed on average: {mean_changed:.2f}")
+        print(f"seconds on average: {stats.recorded_gaps / num_recorded_transitions:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Statistics of the chords logged by cli.py",
+    )
+    parser.add_argument(
+        "path",
+        type=str,
+        nargs="?",
+        default="ratios.csv",
+        help="ratios.csv, or a binary log like ratios.bin",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of processes (default: number of CPUs for logs over 64 MiB, else 1)",
+    )
+    parser.add_argument(
+        "--top",
+        type=int,
+        default=20,
+        help="how many of the most played numbers and intervals to show",
+    )
+    args = parser.parse_args()
+    jobs = args.jobs
+    if jobs is None:
+        jobs = os.cpu_count() if os.path.getsize(args.path) > 64 * 2**20 else 1
+
+    start_time = time.time()
+    stats = analyze_log(args.path, jobs)
+    elapsed = time.time() - start_time
+    print_report(stats, args.top)
+    size = os.path.getsize(args.path)
+    print(f"\nanalyzed {size / 2**20:.1f} MiB in {elapsed:.2f}s ({size / 2**20 / max(elapsed, 1e-9):.0f} MiB/s)")
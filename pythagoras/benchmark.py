@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+
+from polyphonic_player import BIT_RATE, PolyphonicPlayer, timbres
+
+
+def make_chord(num_voices, first_note=3, first_voice_num=0):
+    return [(first_note + i, 1, first_voice_num + i) for i in range(num_voices)]
+
+
+def drive(player, scenario, num_voices, block_duration, num_blocks, on_block=None):
+    """Render num_blocks blocks, sending the commands of the scenario before each.
+
+    - "steady" - the same chord all the time
+    - "chord-switch" - switching between two chords every 10 blocks, with half of
+      the voices shared (switched-off voices keep sounding while they fade out)
+    - "move-note" - moving the lowest note to just above the chord and back,
+      so the target is never a note which is already playing
+
+    on_block is called after each block, with the block render time in ns.
+    """
+    chords = [
+        make_chord(num_voices),
+        make_chord(num_voices // 2) + make_chord(num_voices - num_voices // 2, 101, num_voices),
+    ]
+    player.set_chord(chords[0])
+    player.render_offline(block_duration, block_duration)
+    for i in range(num_blocks):
+        if scenario == "chord-switch" and i % 10 == 0:
+            player.set_chord(chords[(i // 10 + 1) % 2])
+        elif scenario == "move-note":
+            lowest, free_note = chords[0][0][0], chords[0][-1][0] + 1
+            old_freq, new_freq = (lowest, free_note) if i % 2 == 0 else (free_note, lowest)
+            player.move_note(old_freq, new_freq=new_freq)
+        start = time.perf_counter_ns()
+        player.render_offline(block_duration, block_duration)
+        if on_block is not None:
+            on_block(time.perf_counter_ns() - start)
+
+
+def benchmark(scenario, num_voices, block_duration, sample_rate, duration, timbre=None):
+    player = PolyphonicPlayer(
+        output_mode="offline",
+        # quiet enough to never clip, even with fading out voices
+        master_volume=0.5 / num_voices,
+        sample_rate=sample_rate,
+        timbre=timbre,
+    )
+    num_blocks = max(int(duration / block_duration), 1)
+    block_size = int(sample_rate * block_duration)
+
+    # ! timing
+    block_times = []
+    drive(player, scenario, num_voices, block_duration, num_blocks, block_times.append)
+    block_times = np.array(block_times)
+
+    # ! memory, in a separate short run, because tracing slows everything down
+    allocations = []
+
+    def measure_allocations(_):
+        current, peak = tracemalloc.get_traced_memory()
+        allocations.append(peak - current)
+        tracemalloc.reset_peak()
+
+    tracemalloc.start()
+    drive(player, scenario, num_voices, block_duration, min(num_blocks, 50), measure_allocations)
+    tracemalloc.stop()
+
+    total_time = block_times.sum() / 1e9
+    return dict(
+        realtime_factor=num_blocks * block_duration / total_time,
+        ns_per_sample_voice=block_times.mean() / (block_size * num_voices),
+        p99_block_ms=np.percentile(block_times, 99) / 1e6,
+        block_budget_ms=block_duration * 1000,
+        kib_allocated_per_block=np.median(allocations) / 2**10,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure how many voices the player can sustain, without any audio device",
+    )
+    parser.add_argument(
+        "-v",
+        "--voices",
+        type=int,
+        nargs="+",
+        default=[1, 8, 32, 64],
+        help="numbers of voices to try",
+    )
+    parser.add_argument(
+        "-b",
+        "--block-durations",
+        type=float,
+        nargs="+",
+        default=[PolyphonicPlayer.segment_duration],
+        help="block durations in seconds to try",
+    )
+    parser.add_argument(
+        "-r",
+        "--sample-rates",
+        type=int,
+        nargs="+",
+        default=[BIT_RATE],
+        help="sample rates to try",
+    )
+    parser.add_argument(
+        "-s",
+        "--scenarios",
+        type=str,
+        nargs="+",
+        default=["steady", "chord-switch", "move-note"],
+        choices=["steady", "chord-switch", "move-note"],
+        help="which command paths to exercise",
+    )
+    parser.add_argument(
+        "-d",
+        "--duration",
+        type=float,
+        default=2.0,
+        help="seconds of sound to render for each combination",
+    )
+    parser.add_argument(
+        "-t",
+        "--timbre",
+        type=str,
+        default=None,
+        choices=list(timbres.keys()),
+        help="benchmark the wavetable with this timbre, instead of pure sine waves",
+    )
+    args = parser.parse_args()
+
+    header = f"{'scenario':>13}{'voices':>8}{'block':>8}{'rate':>8}{'realtime':>10}{'ns/smp/v':>10}{'p99 ms':>9}{'KiB/blk':>9}"
+    print(header)
+    for scenario in args.scenarios:
+        for sample_rate in args.sample_rates:
+            for block_duration in args.block_durations:
+                for num_voices in args.voices:
+                    result = benchmark(
+                        scenario, num_voices, block_duration, sample_rate, args.duration, args.timbre
+                    )
+                    # mark the combinations which don't keep up with realtime
+                    warning = " !" if result["p99_block_ms"] > result["block_budget_ms"] else ""
+                    print(
+                        f"{scenario:>13}{num_voices:>8}{block_duration * 1000:>6.1f}ms{sample_rate:>8}"
+                        f"{result['realtime_factor']:>9.1f}x{result['ns_per_sample_voice']:>10.2f}"
+                        f"{result['p99_block_ms']:>9.3f}{result['kib_allocated_per_block']:>9.0f}{warning}"
+                    )
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+import argparse
+import multiprocessing
+import time
+from fractions import Fraction
+
+import numpy as np
+
+from config import *
+from lattice import build_lattice, load_smallest_prime_factors, primes_up_to
+
+
+class ChordSearch:
+    """Finds all the chords of size notes in the lattice which meet the constraints.
+
+    Chords are sets of nodes connected by the lattice edges - every note is
+    reached from the others through edges (or, with clique, every two notes
+    are joined by an edge). Optionally, the chords use only the primes up to
+    prime_limit (primes are the ones the lattice was built with), the highest
+    note is at most max_span times the lowest one, and the chord contains an
+    interval (a, b).
+
+    Sets of nodes are Python ints used as bitsets, bit i standing for node i,
+    so the search narrows the candidates with a few integer operations.
+    """
+
+    def __init__(
+        self, lattice, size, primes=None, prime_limit=None, max_span=None, interval=None, clique=False
+    ):
+        self.numbers = lattice.numbers.tolist()
+        self.size = size
+        self.clique = clique
+        self.interval = None if interval is None else Fraction(*interval)
+        if self.interval is not None and self.interval < 1:
+            self.interval = 1 / self.interval
+
+        allowed = np.ones(len(lattice), dtype=bool)
+        if prime_limit is not None:
+            over_limit = np.asarray(primes) > prime_limit
+            allowed = (lattice.exponents[:, over_limit] == 0).all(axis=1)
+        self.roots = np.flatnonzero(allowed).tolist()
+        allowed_bits = sum(1 << i for i in self.roots)
+
+        # adjacency bitsets, without the nodes which are not allowed
+        self.adjacency = []
+        for i in range(len(lattice)):
+            neighbors, _ = lattice.neighbors_of(i)
+            self.adjacency.append(sum(1 << j for j in set(neighbors.tolist())) & allowed_bits)
+
+        # each chord is found from its lowest node, and with a span only
+        # the nodes up to max_span times higher can be in it
+        if max_span is None:
+            ends = np.full(len(lattice), len(lattice))
+        else:
+            ends = np.searchsorted(lattice.numbers, lattice.numbers * max_span, side="right")
+        self.windows = [((1 << int(end)) - (1 << (i + 1))) & allowed_bits for i, end in enumerate(ends)]
+
+    def _has_interval(self, chord):
+        notes = set(chord)
+        for n in chord:
+            higher = n * self.interval
+            if higher.denominator == 1 and higher.numerator in notes:
+                return True
+        return False
+
+    def _extend_connected(self, nodes, extension, closed, window, found):
+        # ESU (Wernicke 2006) - every connected set is built exactly once, by
+        # only adding the neighbors which no node added earlier has
+        if len(nodes) == self.size:
+            found.append(nodes)
+            return
+        while extension:
+            w = (extension & -extension).bit_length() - 1
+            extension &= extension - 1
+            new_neighbors = self.adjacency[w] & ~closed & window
+            self._extend_connected(
+                nodes + [w], extension | new_neighbors, closed | self.adjacency[w] | (1 << w), window, found
+            )
+
+    def _extend_clique(self, nodes, candidates, found):
+        if len(nodes) == self.size:
+            found.append(nodes)
+            return
+        while candidates:
+            # ! not enough candidates left to fill the chord
+            if len(nodes) + candidates.bit_count() < self.size:
+                return
+            w = (candidates & -candidates).bit_length() - 1
+            candidates &= candidates - 1
+            self._extend_clique(nodes + [w], candidates & self.adjacency[w], found)
+
+    def chords_from(self, root):
+        """All the chords whose lowest note is the node root, as tuples of numbers."""
+        window = self.windows[root]
+        found = []
+        if self.clique:
+            self._extend_clique([root], self.adjacency[root] & window, found)
+        else:
+            closed = self.adjacency[root] | (1 << root)
+            self._extend_connected([root], self.adjacency[root] & window, closed, window, found)
+        chords = [tuple(sorted(self.numbers[i] for i in nodes)) for nodes in found]
+        if self.interval is not None:
+            chords = [chord for chord in chords if self._has_interval(chord)]
+        return chords
+
+
+# the search in each worker process, set once by _init_worker
+_worker_search = None
+
+
+def _init_worker(search):
+    global _worker_search
+    _worker_search = search
+
+
+def _chords_from(root):
+    return _worker_search.chords_from(root)
+
+
+def search_chords(search, jobs=1):
+    """Generator of the chords found by a ChordSearch, as soon as they are found.
+
+    With jobs > 1, the lowest notes are split between processes, and the
+    chords come in no particular order. Stop iterating to stop the search.
+    """
+    if jobs == 1:
+        for root in search.roots:
+            yield from search.chords_from(root)
+        return
+    with multiprocessing.Pool(jobs, initializer=_init_worker, initargs=(search,)) as pool:
+        for chords in pool.imap_unordered(_chords_from, search.roots, chunksize=4):
+            yield from chords
+
+
+def parse_interval(text):
+    a, b = text.split(":")
+    return int(a), int(b)
+
+
+def add_search_arguments(parser, prefix=""):
+    """Options of the search, shared with pythagoras.py, which prefixes them with search-."""
+    parser.add_argument(
+        f"--{prefix}span",
+        type=float,
+        default=None,
+        help="the highest note is at most this many times the lowest one, for example 2 for an octave",
+    )
+    parser.add_argument(
+        f"--{prefix}prime-limit",
+        type=int,
+        default=None,
+        help="use only the primes up to this one",
+    )
+    parser.add_argument(
+        f"--{prefix}interval",
+        type=parse_interval,
+        default=None,
+        help="the chord must contain this interval, for example 7:4",
+    )
+    parser.add_argument(
+        f"--{prefix}clique",
+        action="store_true",
+        help="every two notes are joined by an edge, not only connected through other notes",
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Find chords in the lattice which meet some constraints",
+    )
+    parser.add_argument("size", type=int, help="number of notes in the chord")
+    parser.add_argument(
+        "-n",
+        "--number-limit",
+        type=int,
+        default=600,
+        help="use numbers up to this number",
+    )
+    parser.add_argument(
+        "--lattice-prime-limit",
+        type=int,
+        default=max(primes),
+        help="build the lattice from all the primes up to this one",
+    )
+    add_search_arguments(parser)
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="number of processes",
+    )
+    parser.add_argument(
+        "--limit",
+        type=int,
+        default=None,
+        help="stop after finding this many chords",
+    )
+    args = parser.parse_args()
+
+    spf = load_smallest_prime_factors(max(args.number_limit, args.lattice_prime_limit))
+    lattice_primes = primes_up_to(args.lattice_prime_limit, spf)
+    ratios = [(a, b) for a, b, _, _ in draw_lines_for_ratios]
+    lattice = build_lattice(args.number_limit, lattice_primes, ratios, avoid_numbers, spf)
+
+    start_time = time.time()
+    search = ChordSearch(
+        lattice,
+        args.size,
+        primes=lattice_primes,
+        prime_limit=args.prime_limit,
+        max_span=args.span,
+        interval=args.interval,
+        clique=args.clique,
+    )
+    num_found = 0
+    for chord in search_chords(search, args.jobs):
+        print(list(chord))
+        num_found += 1
+        if num_found == args.limit:
+            break
+    print(f"\n{num_found} chords, took {time.time() - start_time:.3f}s")
@@ -1,19 +1,50 @@
 #!/usr/bin/env python3
-import csv
+import argparse
 import math
 import os
 import sys
-from time import time
 
 from colorama import Fore, Style, init
 from pyfiglet import figlet_format
 from readchar import readchar
 
 from polyphonic_player import PolyphonicPlayer
+from session_log import SessionLogger
+
+parser = argparse.ArgumentParser(
+    description="Play chords from the terminal, choosing numbers for 10 slots",
+)
+parser.add_argument(
+    "base_freq",
+    type=int,
+    nargs="?",
+    default=10,
+    help="all numbers will be multiplied by this number to get frequencies in Hz",
+)
+parser.add_argument(
+    "--log-format",
+    type=str,
+    default="csv",
+    choices=["csv", "binary"],
+    help="log chords to ratios.csv, or to ratios.bin with 19 bytes per chord (see session_log.py)",
+)
+parser.add_argument(
+    "--max-log-mb",
+    type=float,
+    default=None,
+    help="when the log gets bigger, it's renamed to ratios.csv.1 (or ratios.bin.1) and a new one started",
+)
+parser.add_argument(
+    "--log-backups",
+    type=int,
+    default=5,
+    help="how many old logs to keep when rotating",
+)
+args = parser.parse_args()
 
 dir_path = os.path.dirname(sys.argv[0])
-FILENAME = os.path.join(dir_path, "ratios.csv")
-BASE_FREQ = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+FILENAME = os.path.join(dir_path, "ratios.csv" if args.log_format == "csv" else "ratios.bin")
+BASE_FREQ = args.base_freq
 
 template = "\n{1:>6}{2:>6}{3:>6}{4:>6}{5:>6}{6:>6}{7:>6}{8:>6}{9:>6}{0:>6}    "
 help_msg = f"""
@@ -25,7 +56,7 @@ for example, typing 45, means {45 * BASE_FREQ} Hz will be played from this slot,
 typing 08, means {8 * BASE_FREQ} Hz will be played
 type 00 to delete sound in this slot
 
-if you like some chord, press r to record it (it will be placed in ratios.csv file)
+if you like some chord, press r to record it (it will be placed in {os.path.basename(FILENAME)} file)
 pressing e will save the chord progression from the previous to this chord
 
 for some ideas of things to try, read:
@@ -95,53 +126,51 @@ def decompose(n, length=6):
         i -= 1
 
 
-def control(player, verbose=True):
+def control(player, logger, verbose=True):
     ratios = [0] * 10
-    with open(FILENAME, "a") as csvfile:
-        writer = csv.writer(csvfile)
-        while True:
-            command = readchar()
-            if command == "h":
-                print(help_msg)
-                continue
-            elif command == "r":
-                writer.writerow([time(), "node"] + ratios)
-                print("chord saved", end="  ", flush=True)
-                continue
-            elif command == "e":
-                writer.writerow([time(), "edge"] + ratios)
-                print("chords saved", end="  ", flush=True)
-                continue
-
-            try:
-                index = get_digit(command)
-                # draw index indicator
-                placeholder = [""] * 10
-                placeholder[index] = "||"
-                print(template.format(*placeholder), end="", flush=True)
-                # read frequency value
-                digit1 = get_digit(readchar())
-                digit2 = get_digit(readchar())
-            except ValueError:
-                print("wrong key", end=" ", flush=True)
-                continue
-            except KeyboardInterrupt:
-                return
-
-            new_ratio = digit1 * 10 + digit2
-            if ratios[index] != 0:
-                # there is an old ratio alraedy, so we need to remove it
-                player.remove_note(ratios[index])
-            player.add_note(new_ratio)
-            ratios[index] = new_ratio
-
-            nums_to_display = [n if n != 0 else "" for n in ratios]
-            print(template.format(*nums_to_display), end="", flush=True)
-            if verbose:
-                factors = (decompose(num) for num in ratios)
-                print(template.format(*factors), end="", flush=True)
-
-            writer.writerow([time(), "auto"] + ratios)
+    while True:
+        command = readchar()
+        if command == "h":
+            print(help_msg)
+            continue
+        elif command == "r":
+            logger.log("node", ratios)
+            print("chord saved", end="  ", flush=True)
+            continue
+        elif command == "e":
+            logger.log("edge", ratios)
+            print("chords saved", end="  ", flush=True)
+            continue
+
+        try:
+            index = get_digit(command)
+            # draw index indicator
+            placeholder = [""] * 10
+            placeholder[index] = "||"
+            print(template.format(*placeholder), end="", flush=True)
+            # read frequency value
+            digit1 = get_digit(readchar())
+            digit2 = get_digit(readchar())
+        except ValueError:
+            print("wrong key", end=" ", flush=True)
+            continue
+        except KeyboardInterrupt:
+            return
+
+        new_ratio = digit1 * 10 + digit2
+        if ratios[index] != 0:
+            # there is an old ratio alraedy, so we need to remove it
+            player.remove_note(ratios[index])
+        player.add_note(new_ratio)
+        ratios[index] = new_ratio
+
+        nums_to_display = [n if n != 0 else "" for n in ratios]
+        print(template.format(*nums_to_display), end="", flush=True)
+        if verbose:
+            factors = (decompose(num) for num in ratios)
+            print(template.format(*factors), end="", flush=True)
+
+        logger.log("auto", ratios)
 
 
 if __name__ == "__main__":
@@ -154,6 +183,19 @@ if __name__ == "__main__":
     player.start()
     print(figlet_format("Pythagoras", font="graffiti"))
     print("press h for help")
-    control(player)
-    player.kill()
-    player.join()
+    # * written in the background, so that logging never delays the keys
+    logger = SessionLogger(
+        FILENAME,
+        format=args.log_format,
+        max_bytes=None if args.max_log_mb is None else int(args.max_log_mb * 2**20),
+        backup_count=args.log_backups,
+    )
+    try:
+        control(player, logger)
+    finally:
+        # * also on Ctrl+C, so that the chords still waiting in the queue get written
+        logger.close()
+        player.kill()
+        player.join()
+    if logger.dropped:
+        print(f"\n{logger.dropped} chords were not logged, because the disk was too slow")
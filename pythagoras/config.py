@@ -18,6 +18,8 @@ circle_size = 0.009
 line_width = 0.002
 text_size = circle_size * 0.9
 margin = 0.06
+# in viewport mode, each scroll step zooms by this factor
+zoom_step = 1.25
 
 primes = [2, 3, 5]
 draw_lines_for_ratios = [  # ratio, inactive_color, active_color
@@ -36,6 +38,7 @@ for i in range(10):
     avoid_numbers.add(i * 125)
     avoid_numbers.add(i * 49)
 
+# further primes get generated columns, see extend_placement
 placement_matrices = dict(
     logarithmic=np.array(
         [
@@ -43,7 +46,6 @@ placement_matrices = dict(
             [0, -0.866, -0.200, -0.740],
         ]
     ),
-    # TODO add a fourth row for the fourth prime
     clear=np.array(
         [
             [1, 1.500, 2.030],
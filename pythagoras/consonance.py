@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+import argparse
+import fnmatch
+import functools
+import math
+import time
+
+import numpy as np
+
+from polyphonic_player import timbres
+from storage import ChordsSaver, add_storage_argument
+
+# amplitudes of the partials of each note, when no timbre is given
+# (the ones Sethares uses in "Tuning, Timbre, Spectrum, Scale")
+default_partials = [0.88**k for k in range(6)]
+score_dtype = np.dtype([("roughness", "<f8"), ("entropy", "<f8"), ("tenney", "<f8")])
+
+# constants of the Plomp-Levelt curve, as parametrized by Sethares
+_curve_max = 0.24
+_s1, _s2 = 0.0207, 18.96
+_b1, _b2 = 3.51, 5.75
+
+
+def as_note_array(chords):
+    """Chords as an array of notes, one row per chord, padded with 0.
+
+    A chord is a list of numbers, or a saved chord with [freq, volume, voice] entries.
+    """
+    chords = [[note[0] if isinstance(note, (list, tuple)) else note for note in chord] for chord in chords]
+    notes = np.zeros((len(chords), max(map(len, chords), default=0)), dtype=np.int64)
+    for i, chord in enumerate(chords):
+        notes[i, : len(chord)] = chord
+    return notes
+
+
+def pair_roughness(low, high, base_freq=10, partials=default_partials):
+    """Roughness between all the partials of notes low and high, for arrays of note pairs.
+
+    Every pair of partials adds min(a1, a2) * (exp(-b1 s df) - exp(-b2 s df)),
+    where df is the distance of the partials in Hz and s scales the curve to
+    the critical band at the lower one.
+    """
+    amplitudes = np.asarray(partials, dtype=float)
+    harmonics = np.arange(1, len(amplitudes) + 1)
+    pair_amplitudes = np.minimum.outer(amplitudes, amplitudes)
+    low = np.asarray(low, dtype=float).ravel()
+    high = np.asarray(high, dtype=float).ravel()
+    roughness = np.empty(len(low))
+    # * in chunks, so that the pairs x partials x partials arrays stay small
+    chunk = max(2**20 // len(amplitudes) ** 2, 1)
+    for start in range(0, len(low), chunk):
+        f1 = base_freq * np.multiply.outer(low[start : start + chunk], harmonics)[:, :, None]
+        f2 = base_freq * np.multiply.outer(high[start : start + chunk], harmonics)[:, None, :]
+        s = _curve_max / (_s1 * np.minimum(f1, f2) + _s2)
+        df = np.abs(f2 - f1)
+        curve = np.exp(-_b1 * s * df) - np.exp(-_b2 * s * df)
+        roughness[start : start + chunk] = (curve * pair_amplitudes).sum(axis=(1, 2))
+    return roughness
+
+
+# (base_freq, partials) -> table of pair roughness, grown when higher notes come
+_roughness_tables = dict()
+max_table_note = 1023
+
+
+def roughness_table(max_note, base_freq=10, partials=default_partials):
+    """Memoized table[a, b] of pair_roughness for notes up to at least max_note.
+
+    table[n, n] is the roughness between the partials of n itself, and row
+    and column 0 (an empty slot) are 0.
+    """
+    key = (base_freq, tuple(partials))
+    table = _roughness_tables.get(key)
+    if table is not None and len(table) > max_note:
+        return table
+    size = 2 ** math.ceil(math.log2(max_note + 1))
+    low, high = np.triu_indices(size)
+    values = pair_roughness(low, high, base_freq, partials)
+    # within a note, every pair of its partials was counted twice
+    values[low == high] /= 2
+    table = np.zeros((size, size))
+    table[low, high] = values
+    table[high, low] = values
+    table[0, :] = table[:, 0] = 0
+    _roughness_tables[key] = table
+    return table
+
+
+def distinct_notes(notes):
+    """The notes of each chord sorted, with a doubled note kept once and an empty slot (0) in its place."""
+    notes = np.sort(np.asarray(notes, dtype=np.int64), axis=1)
+    notes[:, 1:][notes[:, 1:] == notes[:, :-1]] = 0
+    return notes
+
+
+def chord_roughness(notes, base_freq=10, partials=default_partials):
+    """Total roughness of each chord (a row of distinct notes, 0 for an empty slot)."""
+    notes = np.asarray(notes, dtype=np.int64)
+    table = roughness_table(min(notes.max(initial=0), max_table_note), base_freq, partials)
+    i, j = np.triu_indices(notes.shape[1])
+    low = np.minimum(notes[:, i], notes[:, j])
+    high = np.maximum(notes[:, i], notes[:, j])
+    # ! notes above the table are rare, so their pairs are computed directly
+    too_high = high >= len(table)
+    pair_values = table[np.where(too_high, 0, low), np.where(too_high, 0, high)]
+    computed = too_high & (low > 0)
+    pair_values[computed] = pair_roughness(low[computed], high[computed], base_freq, partials)
+    pair_values[computed & (i == j)[None, :]] /= 2
+    return pair_values.sum(axis=1)
+
+
+@functools.lru_cache
+def harmonic_entropy_curve(max_cents=8000, spread=17, max_height=10000):
+    """Harmonic entropy of intervals from 0 to max_cents, in steps of 1 cent.
+
+    An interval is heard as one of the ratios p/q with p * q <= max_height,
+    with probability from a gaussian of its distance to the ratio (spread in
+    cents) times 1 / sqrt(p * q). The entropy of this guess is low for the
+    intervals close to only one simple ratio.
+    """
+    q, p = np.meshgrid(np.arange(1, math.isqrt(max_height) + 1), np.arange(1, max_height + 1))
+    is_ratio = (p >= q) & (p * q <= max_height) & (np.gcd(p, q) == 1)
+    p, q = p[is_ratio], q[is_ratio]
+    ratio_cents = 1200 * np.log2(p / q)
+    order = np.argsort(ratio_cents)
+    ratio_cents, weights = ratio_cents[order], 1 / np.sqrt(p * q)[order]
+
+    cents = np.arange(max_cents + 1, dtype=float)
+    entropy = np.empty(len(cents))
+    # * only the ratios within a few spreads matter, so go over the cents in blocks
+    block = 100
+    for start in range(0, len(cents), block):
+        block_cents = cents[start : start + block]
+        first, last = np.searchsorted(ratio_cents, [block_cents[0] - 5 * spread, block_cents[-1] + 5 * spread])
+        distances = block_cents[:, None] - ratio_cents[None, first:last]
+        probabilities = np.exp(-(distances**2) / (2 * spread**2)) * weights[first:last]
+        probabilities /= probabilities.sum(axis=1, keepdims=True)
+        entropy[start : start + block] = -(probabilities * np.log(np.maximum(probabilities, 1e-300))).sum(axis=1)
+    return entropy
+
+
+def chord_entropy(notes, spread=17):
+    """Mean harmonic entropy of the intervals in each chord of distinct notes, 0 for fewer than two notes."""
+    notes = np.asarray(notes, dtype=np.int64)
+    curve = harmonic_entropy_curve(spread=spread)
+    i, j = np.triu_indices(notes.shape[1], k=1)
+    low = np.minimum(notes[:, i], notes[:, j])
+    high = np.maximum(notes[:, i], notes[:, j])
+    is_pair = (low > 0) & (low != high)
+    cents = 1200 * np.log2(np.where(is_pair, high, 1) / np.where(is_pair, low, 1))
+    # intervals wider than the curve get its last value
+    pair_entropy = np.interp(cents, np.arange(len(curve)), curve) * is_pair
+    num_pairs = is_pair.sum(axis=1)
+    return pair_entropy.sum(axis=1) / np.maximum(num_pairs, 1)
+
+
+def tenney_height(notes):
+    """log2 of the product of the notes, after dividing them by their greatest common divisor.
+
+    For an interval p/q this is log2(p * q), and for a chord a:b:c log2(a * b * c).
+    """
+    notes = np.asarray(notes, dtype=np.int64)
+    # gcd with an empty slot (0) doesn't change it
+    divisors = np.maximum(np.gcd.reduce(notes, axis=1), 1)
+    reduced = notes / divisors[:, None]
+    return np.log2(np.where(notes > 0, reduced, 1)).sum(axis=1)
+
+
+def score_chords(chords, base_freq=10, partials=default_partials, spread=17):
+    """Roughness, harmonic entropy and Tenney height of many chords at once.
+
+    chords is an array of notes, one row per chord, padded with 0, or a list
+    of chords for as_note_array. A note doubled in two slots counts once.
+    Returns an array of score_dtype.
+    """
+    notes = chords if isinstance(chords, np.ndarray) else as_note_array(chords)
+    scores = np.zeros(len(notes), dtype=score_dtype)
+    if len(notes) == 0 or notes.shape[1] == 0:
+        return scores
+    # * in chunks, so that the chords x pairs arrays stay small
+    chunk = 2**16
+    for start in range(0, len(notes), chunk):
+        chunk_notes = distinct_notes(notes[start : start + chunk])
+        chunk_scores = scores[start : start + chunk]
+        chunk_scores["roughness"] = chord_roughness(chunk_notes, base_freq, partials)
+        chunk_scores["entropy"] = chord_entropy(chunk_notes, spread)
+        chunk_scores["tenney"] = tenney_height(chunk_notes)
+    return scores
+
+
+def unique_chords(notes, counts=None):
+    """The different chords among the rows of notes, and how many times each appears."""
+    if counts is None:
+        counts = np.ones(len(notes), dtype=np.int64)
+    # sorted, so the same notes in other slots are the same chord
+    notes = np.ascontiguousarray(-np.sort(-notes, axis=1))
+    # * rows compared as raw bytes sort much faster than with axis=0
+    rows = notes.view(np.dtype((np.void, notes.dtype.itemsize * notes.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+    return notes[first], np.bincount(inverse.ravel(), weights=counts, minlength=len(first)).astype(np.int64)
+
+
+def log_chords(path, chunk_bytes=2**22):
+    """The different chords played in a session log, and how many times each was played."""
+    # imported here, so that scoring saves doesn't need it
+    from analytics import read_log
+
+    parts = [unique_chords(ratios) for _, _, ratios in read_log(path, chunk_bytes)]
+    if not parts:
+        return np.zeros((0, 0), dtype=np.int64), np.zeros(0, dtype=np.int64)
+    notes, counts = unique_chords(np.concatenate([n for n, _ in parts]), np.concatenate([c for _, c in parts]))
+    # an empty row is not a chord
+    played = notes.any(axis=1)
+    return notes[played].astype(np.int64), counts[played]
+
+
+def print_ranking(labels, notes, scores, sort_by="roughness", top=20, reverse=False):
+    order = np.argsort(scores[sort_by], kind="stable")
+    if reverse:
+        order = order[::-1]
+    print(f"{'roughness':>10} {'entropy':>8} {'tenney':>7}  chord")
+    for i in order[:top]:
+        chord = sorted(int(n) for n in notes[i] if n)
+        roughness, entropy, tenney = scores[i]
+        print(f"{roughness:>10.4f} {entropy:>8.3f} {tenney:>7.2f}  {chord}  {labels[i]}")
+    print(f"\n{len(order)} chords")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Score chords by roughness, harmonic entropy and Tenney height, and rank them",
+    )
+    parser.add_argument(
+        "-f",
+        "--base-freq",
+        type=int,
+        default=10,
+        help="all numbers will be multiplied by this number to get frequencies in Hz",
+    )
+    parser.add_argument(
+        "--timbre",
+        type=str,
+        default=None,
+        choices=list(timbres.keys()),
+        help="take the partials of the notes from this timbre, instead of 6 decaying harmonics",
+    )
+    parser.add_argument(
+        "--spread",
+        type=float,
+        default=17,
+        help="how precisely intervals are heard, in cents, for the harmonic entropy",
+    )
+    parser.add_argument(
+        "--sort",
+        type=str,
+        default="roughness",
+        choices=list(score_dtype.names),
+        help="score to rank the chords by, the most consonant first",
+    )
+    parser.add_argument("--reverse", action="store_true", help="show the least consonant first")
+    parser.add_argument("--top", type=int, default=20, help="how many chords to show")
+    for name in score_dtype.names:
+        parser.add_argument(f"--max-{name}", type=float, default=None, help=f"only chords with {name} up to this")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    saves_parser = subparsers.add_parser("saves", help="chords of the saves")
+    add_storage_argument(saves_parser)
+    saves_parser.add_argument(
+        "--match",
+        type=str,
+        default="*",
+        help="only the saves whose names match this pattern, like 'chill-*'",
+    )
+    log_parser = subparsers.add_parser("log", help="chords played in a session log of cli.py")
+    log_parser.add_argument(
+        "path",
+        type=str,
+        nargs="?",
+        default="ratios.csv",
+        help="ratios.csv, or a binary log like ratios.bin",
+    )
+    args = parser.parse_args()
+    partials = default_partials if args.timbre is None else timbres[args.timbre]
+
+    start_time = time.time()
+    if args.command == "saves":
+        chords_saver = ChordsSaver(args.storage)
+        labels, chords = [], []
+        for save_name in fnmatch.filter(chords_saver.names(), args.match):
+            for keyname, value in chords_saver.load(save_name).items():
+                if keyname == "history":
+                    labels += [f"{save_name} (history step {step})" for step in range(len(value))]
+                    chords += value
+                else:
+                    labels.append(f"{save_name} (key {keyname})")
+                    chords.append(value)
+        notes = as_note_array(chords)
+    else:
+        notes, counts = log_chords(args.path)
+        labels = [f"played {count} times" for count in counts]
+
+    scores = score_chords(notes, args.base_freq, partials, args.spread)
+    kept = np.ones(len(scores), dtype=bool)
+    for name in score_dtype.names:
+        limit = getattr(args, f"max_{name}")
+        if limit is not None:
+            kept &= scores[name] <= limit
+    kept = np.flatnonzero(kept)
+    print_ranking([labels[i] for i in kept], notes[kept], scores[kept], args.sort, args.top, args.reverse)
+    print(f"took {time.time() - start_time:.3f}s")
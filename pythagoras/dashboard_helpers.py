@@ -1,92 +1,40 @@
 import os
-import json
-import pathlib
-from collections import defaultdict
+import hashlib
+import shutil
+from collections import deque
 
 import pygame
 import numpy as np
-import networkx as nx
-import randomname
 
 from config import *
+from gestalt import GestaltAnalyzer
+from lattice import Lattice, SpatialGrid, build_lattice, decompose_into_small_primes, tables_dir
+from storage import ChordsSaver
 
+# built lattices are cached in data/lattice_cache, which can be deleted at any time
+# bump the version when Lattice.save or the placement of the nodes changes, so old caches aren't loaded
+LATTICE_CACHE_VERSION = 1
+# only this many of the most recently used lattices are kept
+LATTICE_CACHE_SIZE = 8
 
-def decompose_into_small_primes(n, primes=[2, 3, 5, 7]):
-    factors = np.zeros_like(primes)
-    while n != 1:
-        updated = False
-        for i, prime in enumerate(primes):
-            if n % prime == 0:
-                n /= prime
-                factors[i] += 1
-                updated = True
-        if not updated:
-            # n cannot be decomposed into those primes
-            return None
-    return factors
-
-
-class ChordsSaver:
-    def __init__(self):
-        base_dir = pathlib.Path(__file__).parent.parent
-        self.saved_chords_file = os.path.join(base_dir, "data", "saved_chords.txt")
-        self.all_saves = dict()
-        if os.path.isfile(self.saved_chords_file):
-            with open(self.saved_chords_file, "r") as f:
-                for line in f:
-                    save_name, save_dict = json.loads(line).popitem()
-                    self.all_saves[save_name] = save_dict
-
-    def get_save(self, save_name):
-        try:
-            save = self.all_saves[save_name]
-        except KeyError:
-            print("Error: there is no save with this name")
-            exit(1)
-
-        print("\nloaded chords:")
-        for keyname, chord in save.items():
-            if keyname == "history":
-                history = chord
-                continue
-            print(f"{keyname}: {[freq for freq, _, _ in chord]}")
-        if "history" in save:
-            print("\nhistory:")
-            for chord in history:
-                print(f"{[freq for freq, _, _ in chord]}")
-        self.last_loaded_save_name = save_name
-
-        # * note that save is a dict so it is passes by reference and will be modified
-        return save
-
-    def save_all_saves(self):
-        with open(self.saved_chords_file, "w") as f:
-            for save_name, save in self.all_saves.items():
-                if save:
-                    f.write(json.dumps({save_name: save}) + "\n")
-        print("\nchords saved")
-
-    def create_new_save(self):
-        all_save_names = list(self.all_saves.keys())
-        # make sure the name is unique
-        while True:
-            save_name = randomname.get_name()
-            if save_name not in all_save_names:
-                break
-        self.all_saves[save_name] = dict()
-        self.last_loaded_save_name = save_name
-        return self.all_saves[save_name]
+
+def _prune_lattice_cache(cache_dir, keep):
+    entries = sorted(cache_dir.iterdir(), key=lambda path: path.stat().st_mtime, reverse=True)
+    for path in entries[keep:]:
+        shutil.rmtree(path, ignore_errors=True)
 
 
 class Drawer:
-    def __init__(self, placement_matrix, n_limit):
+    def __init__(self, placement_matrix, n_limit, primes=primes, spf=None):
         pygame.display.init()
         pygame.font.init()
 
         self.placement_matrix = placement_matrix
         self.n_limit = n_limit
+        self.primes = primes
+        self.spf = spf
 
-        self.G = nx.Graph()
+        self.lattice = None
         _desktop_sizes = pygame.display.get_desktop_sizes()
         self.resolution = _desktop_sizes[-1]
         self.dis = pygame.display.set_mode(self.resolution, pygame.FULLSCREEN, display=len(_desktop_sizes)-1)
@@ -101,110 +49,200 @@ class Drawer:
         self.font = pygame.font.SysFont("arial", int(_text_size))
         self.coordinate_center = np.array([self.margin, self.resolution[1] - self.margin])
 
-    def redraw_circle(self, dis, n):
-        if self.G.nodes[n]["active"]:
-            color = yellow
-        else:
-            color = white
-        pygame.draw.circle(dis, color, self.G.nodes[n]["position"], self.circle_size)
-        # print a number in the circle
-        text = self.font.render(str(n), True, black)
-        text_rect = text.get_rect()
-        text_rect.center = self.G.nodes[n]["position"]
-        dis.blit(text, text_rect)
+        self.gestalt_analyzer = GestaltAnalyzer()
+
+        # view transform: screen position = world position * zoom + pan
+        self.zoom_level = 0
+        self.zoom = 1.0
+        self.pan = np.zeros(2)
+
+        # (n, active, zoom_level) -> pre-rendered circle with its number,
+        # rendered only once the node gets into view at this zoom
+        # n is None for circles too small to fit a number
+        self.sprites = dict()
+        # parts of the screen changed since the last update_display
+        self.dirty_rects = []
+
+    def get_sprite(self, n, active):
+        # level of detail - when zoomed out, skip the numbers which wouldn't fit in the circle
+        if self.zoom_level < 0 and self.font.size(str(n))[0] > 2 * self.view_circle_size:
+            n = None
+        key = (n, active, self.zoom_level)
+        if key not in self.sprites:
+            radius = int(np.ceil(self.view_circle_size))
+            sprite = pygame.Surface((2 * radius + 1, 2 * radius + 1), pygame.SRCALPHA)
+            color = yellow if active else white
+            pygame.draw.circle(sprite, color, (radius, radius), self.view_circle_size)
+            if n is not None:
+                # print a number in the circle
+                text = self.font.render(str(n), True, black)
+                text_rect = text.get_rect()
+                text_rect.center = (radius, radius)
+                sprite.blit(text, text_rect)
+            self.sprites[key] = sprite
+        return self.sprites[key]
+
+    def redraw_circle(self, dis, i):
+        # i is a node index in the lattice
+        sprite = self.get_sprite(int(self.lattice.numbers[i]), bool(self.lattice.active[i]))
+        rect = sprite.get_rect()
+        rect.center = self.positions[i]
+        self.dirty_rects.append(dis.blit(sprite, rect))
+        if self.highlighted_mask[i]:
+            ring_size = self.view_circle_size + 2 * self.view_line_width
+            self.dirty_rects.append(
+                pygame.draw.circle(dis, orange, self.positions[i], ring_size, self.view_line_width)
+            )
+
+    def update_display(self):
+        # push only the changed parts of the screen
+        pygame.display.update(self.dirty_rects)
+        self.dirty_rects = []
+
+    def _repaint_edges(self, i):
+        # repaint edges between node i and its active neighbors
+        neighbors, edges = self.lattice.neighbors_of(i)
+        for neighbor, edge in zip(neighbors.tolist(), edges.tolist()):
+            if not self.lattice.active[neighbor]:
+                continue
+            if self.lattice.active[i]:
+                color = self.edge_colors1[self.lattice.edge_kinds[edge]]
+            else:
+                color = self.edge_colors0[self.lattice.edge_kinds[edge]]
+            position1 = self.positions[i]
+            position2 = self.positions[neighbor]
+            rect = pygame.draw.line(self.dis, color, position1, position2, self.view_line_width)
+            self.dirty_rects.append(rect)
+            self.redraw_circle(self.dis, neighbor)
+        self.redraw_circle(self.dis, i)
 
     def activate_node(self, n, volume=1):
-        if n not in self.G.nodes:
+        i = self.lattice.index(n)
+        if i is None:
             print(f"Warning: node {n} not in graph. Consider increasing number-limit.")
             return
-        self.G.nodes[n]["active"] = True
-        # paint edges
-        for neighbor in self.G[n]:
-            edge = self.G[n][neighbor]
-            if self.G.nodes[neighbor]["active"]:
-                edge["active"] = True
-                position1 = self.G.nodes[n]["position"]
-                position2 = self.G.nodes[neighbor]["position"]
-                pygame.draw.line(self.dis, edge["color1"], position1, position2, self.line_width)
-                self.redraw_circle(self.dis, neighbor)
-        self.redraw_circle(self.dis, n)
+        self.lattice.active[i] = True
+        self._repaint_edges(i)
 
     def deactivate_node(self, n):
-        self.G.nodes[n]["active"] = False
-        # paint edges
-        for neighbor in self.G[n]:
-            edge = self.G[n][neighbor]
-            if self.G.nodes[neighbor]["active"]:
-                # there was an active edge
-                edge["active"] = False
-                position1 = self.G.nodes[n]["position"]
-                position2 = self.G.nodes[neighbor]["position"]
-                pygame.draw.line(self.dis, edge["color0"], position1, position2, self.line_width)
-                self.redraw_circle(self.dis, neighbor)
-        self.redraw_circle(self.dis, n)
-
-    def create_graph(self):
-        # ! create circles
-        for n in range(1, self.n_limit + 1):
-            if n in avoid_numbers:
-                continue
-            decomposition = decompose_into_small_primes(n, primes=primes)
-            if decomposition is None:
-                continue
-            position = (
-                self.placement_matrix @ decomposition
+        i = self.lattice.index(n)
+        self.lattice.active[i] = False
+        self._repaint_edges(i)
+
+    def create_graph(self, use_cache=True):
+        ratios = [(a, b) for a, b, _, _ in draw_lines_for_ratios]
+        self.edge_colors0 = [color0 for _, _, color0, _ in draw_lines_for_ratios]
+        self.edge_colors1 = [color1 for _, _, _, color1 in draw_lines_for_ratios]
+
+        # * the same settings always give the same graph, so it's built once and then loaded
+        settings = repr(
+            (
+                LATTICE_CACHE_VERSION,
+                self.placement_matrix.tolist(),
+                self.n_limit,
+                list(self.primes),
+                ratios,
+                sorted(avoid_numbers),
+                self.resolution,
+                self.displacement,
+                self.margin,
+            )
+        )
+        key = hashlib.sha1(settings.encode()).hexdigest()[:16]
+        cache_path = tables_dir / "lattice_cache" / key
+        if use_cache and os.path.isdir(cache_path):
+            self.lattice, arrays = Lattice.load(cache_path)
+            self.world_positions = arrays["world_positions"]
+            # mark it as recently used
+            os.utime(cache_path)
+        else:
+            self.lattice = build_lattice(self.n_limit, self.primes, ratios, avoid_numbers, self.spf)
+            # positions of the nodes at no zoom and no pan
+            self.world_positions = (
+                self.lattice.exponents @ self.placement_matrix.T
             ) * self.displacement + self.coordinate_center
-            self.G.add_node(n, active=False, position=position)
-        # ! create edges
-        for a, b, color0, color1 in draw_lines_for_ratios:
-            for n1 in self.G.nodes:
-                for n2 in self.G.nodes:
-                    if n2 / n1 != a / b:
-                        continue
-                    self.G.add_edge(n1, n2, color0=color0, color1=color1, active=False)
+            if use_cache:
+                os.makedirs(cache_path.parent, exist_ok=True)
+                self.lattice.save(cache_path, world_positions=self.world_positions)
+                _prune_lattice_cache(cache_path.parent, LATTICE_CACHE_SIZE)
+        # nodes with a ring around them, see highlight_candidates
+        self.highlighted_mask = np.zeros(len(self.lattice), dtype=bool)
+        # index the positions, so that clicks and culling don't have to check every node
+        self.grid = SpatialGrid(self.world_positions, cell_size=2 * self.circle_size)
+        self._update_view()
+
+    def _update_view(self):
+        # screen positions of the nodes, and which of them are in view
+        self.positions = self.world_positions * self.zoom + self.pan
+        self.view_circle_size = self.circle_size * self.zoom
+        self.view_line_width = max(1, round(self.line_width * self.zoom))
+        # nodes partly on the screen are in view too
+        low = (np.zeros(2) - self.pan) / self.zoom - self.circle_size
+        high = (np.array(self.resolution) - self.pan) / self.zoom + self.circle_size
+        self.visible_nodes = self.grid.find_in_rect(low, high)
+        self.visible = np.zeros(len(self.lattice), dtype=bool)
+        self.visible[self.visible_nodes] = True
+
+    def zoom_at(self, screen_pos, steps):
+        """Zoom in by the given number of steps (out if negative), keeping screen_pos in place."""
+        self.zoom_level += steps
+        new_zoom = zoom_step**self.zoom_level
+        screen_pos = np.asarray(screen_pos, dtype=float)
+        self.pan = screen_pos - (screen_pos - self.pan) * new_zoom / self.zoom
+        self.zoom = new_zoom
+        self._update_view()
+
+    def pan_by(self, shift):
+        self.pan = self.pan + shift
+        self._update_view()
 
     def draw_graph(self):
         # ! clear the screen
         self.dis.fill(black)
-        # ! draw edges
-        for u, v, edge_data in self.G.edges.data():
-            position1 = self.G.nodes[u]["position"]
-            position2 = self.G.nodes[v]["position"]
-            if edge_data["active"]:
-                color = edge_data["color1"]
-            else:
-                color = edge_data["color0"]
-            pygame.draw.line(self.dis, color, position1, position2, self.line_width)
-        # ! draw circles
-        for n in self.G.nodes:
-            self.redraw_circle(self.dis, n)
+        # ! draw edges touching the view
+        edge_nodes = self.lattice.edge_nodes
+        in_view = self.visible[edge_nodes[:, 0]] | self.visible[edge_nodes[:, 1]]
+        active_edges = self.lattice.active_edges()[in_view]
+        edges = zip(edge_nodes[in_view].tolist(), self.lattice.edge_kinds[in_view].tolist(), active_edges)
+        for (u, v), kind, active in edges:
+            color = self.edge_colors1[kind] if active else self.edge_colors0[kind]
+            pygame.draw.line(self.dis, color, self.positions[u], self.positions[v], self.view_line_width)
+        # ! draw circles in view
+        for i in self.visible_nodes.tolist():
+            self.redraw_circle(self.dis, i)
         pygame.display.update()
+        self.dirty_rects = []
 
     def get_clicked_node(self, click_pos):
-        for n in self.G.nodes:
-            position = self.G.nodes[n]["position"]
-            if np.linalg.norm(click_pos - position) < self.circle_size:
-                return n
-        return None
+        world_pos = (np.asarray(click_pos) - self.pan) / self.zoom
+        i = self.grid.find_nearest(world_pos, self.circle_size)
+        if i is None:
+            return None
+        return int(self.lattice.numbers[i])
+
+    def highlight_candidates(self, chords):
+        """Put rings around the notes of the given chords."""
+        indexes = {self.lattice.index(n) for chord in chords for n in chord} - {None}
+        self.highlighted_mask[:] = False
+        self.highlighted_mask[list(indexes)] = True
+        self.draw_graph()
 
     def is_active(self, node):
-        return self.G.nodes[node]["active"]
+        return bool(self.lattice.active[self.lattice.index(node)])
 
     def clear_all(self):
-        for node in self.G.nodes:
-            if self.G.nodes[node]["active"]:
-                self.deactivate_node(node)
-        pygame.display.update()
+        for i in np.flatnonzero(self.lattice.active):
+            self.deactivate_node(int(self.lattice.numbers[i]))
+        self.update_display()
 
     def draw_chord(self, chord):
         # deactivate
-        for node in self.G.nodes:
-            if self.G.nodes[node]["active"]:
-                self.deactivate_node(node)
+        for i in np.flatnonzero(self.lattice.active):
+            self.deactivate_node(int(self.lattice.numbers[i]))
         # activate
         for freq, volume, _ in chord:
             self.activate_node(freq, volume)
-        pygame.display.update()
+        self.update_display()
 
     def draw_binding_view(self, chord, slope=1):
         def get_dot_position(freq, base_freq):
@@ -227,46 +265,19 @@ class Drawer:
             pygame.draw.circle(self.dis, white, note_position, dot_size)
 
         # create gestalts
-        # fmt: off
-        ratios = [
-            (2,1), (3,1), (4,1), (5,1), (6,1), (7,1), (8,1),
-            (3,2), (5,2), (7,2), 
-            (4,3), (5,3), (7,3), (8,3),
-            (5,4), (7,4), 
-            (6,5), (7,5), (8,5),
-            (7,6), 
-            (8,7),
-        ]
-        # fmt: on
-        gestalt = defaultdict(set)  # for a base note, list te harmonics connected to it
-        gestalt_affiliation = defaultdict(
-            set
-        )  # for a note, list the base notes of gestalts that it is in
-        for a, b in ratios:
-            for (
-                freq1,
-                vol1,
-                _,
-            ) in chord:
-                for freq2, vol2, _ in chord:
-                    if freq2 / freq1 != a / b:
-                        continue
-                    base_note = freq2 / a
-                    gestalt[base_note].add(freq2)
-                    gestalt[base_note].add(freq1)
-                    gestalt_affiliation[freq1].add(base_note)
-                    gestalt_affiliation[freq2].add(base_note)
+        self.gestalt_analyzer.set_chord([freq for freq, _, _ in chord])
+        gestalt, gestalt_affiliation = self.gestalt_analyzer.get_gestalts()
 
         # draw gestalts
         volume_dict = {freq: vol for freq, vol, _ in chord}
         for base_note, freqs in gestalt.items():
             min_freq = min(freqs)
             max_freq = max(freqs)
-            min_pos = get_dot_position(min_freq, base_note)
-            max_pos = get_dot_position(max_freq, base_note)
+            min_pos = get_dot_position(min_freq, float(base_note))
+            max_pos = get_dot_position(max_freq, float(base_note))
             pygame.draw.line(self.dis, white, min_pos, max_pos, self.line_width)
             for freq in freqs:
-                position = get_dot_position(freq, base_note)
+                position = get_dot_position(freq, float(base_note))
                 dot_size = self.line_width + np.sqrt(volume_dict[freq]) * 1 * self.line_width
                 pygame.draw.circle(self.dis, white, position, dot_size)
 
@@ -274,42 +285,143 @@ class Drawer:
         for freq, base_notes in gestalt_affiliation.items():
             min_base_note = min(base_notes)
             max_base_note = max(base_notes)
-            min_pos = get_dot_position(freq, min_base_note)
-            max_pos = get_dot_position(freq, max_base_note)
+            min_pos = get_dot_position(freq, float(min_base_note))
+            max_pos = get_dot_position(freq, float(max_base_note))
             pygame.draw.line(self.dis, white, min_pos, max_pos, self.line_width)
 
         pygame.display.update()
 
+    def draw_stats_overlay(self, stats):
+        """Show the player stats (from PolyphonicPlayer.get_stats) in the top left corner."""
+        lines = [
+            f"voices: {stats['active_voices']}   queued commands: {stats['queue_depth']}",
+            f"render: p50 {stats['render_ms_p50']:.2f} ms   p99 {stats['render_ms_p99']:.2f} ms",
+            f"write: p50 {stats['write_ms_p50']:.2f} ms   p99 {stats['write_ms_p99']:.2f} ms",
+            f"underruns: {stats['underruns']}   underflows: {stats['stream_underflows']}   overruns: {stats['overruns']}",
+            f"peak level: {stats['peak_level']:.2f}   max: {stats['max_peak_level']:.2f}",
+        ]
+        texts = [self.font.render(line, True, white) for line in lines]
+        line_height = self.font.get_linesize()
+        padding = line_height // 2
+        width = max(text.get_width() for text in texts) + 2 * padding
+        height = line_height * len(texts) + 2 * padding
+        rect = pygame.Rect(0, 0, width, height)
+        self.dis.fill(black, rect)
+        for i, text in enumerate(texts):
+            self.dis.blit(text, (padding, padding + i * line_height))
+        pygame.display.update(rect)
+
+
+def _chord_state(chord):
+    # freq -> (volume, voice_num)
+    return {freq: (volume, voice_num) for freq, volume, voice_num in chord}
+
+
+def _chord_delta(state1, state2):
+    # (freq, note before, note after) for every added, removed or re-volumed note
+    # where None means no note, so the delta can be applied both ways
+    return tuple(
+        (freq, state1.get(freq), state2.get(freq))
+        for freq in state1.keys() | state2.keys()
+        if state1.get(freq) != state2.get(freq)
+    )
+
+
+class ChordStack:
+    """Stack of chords, kept as its bottom chord and the deltas between the next ones.
+
+    The chord on top is kept whole too, so push and pop only apply one delta.
+    Above max_size chords, the bottom ones are dropped, by applying the first
+    delta to the bottom chord.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.bottom = None
+        self.top = None
+        self.deltas = deque()
+
+    def __len__(self):
+        return 0 if self.bottom is None else len(self.deltas) + 1
+
+    def push(self, chord):
+        state = _chord_state(chord)
+        if self.bottom is None:
+            self.bottom = state
+            self.top = dict(state)
+            return
+        self.deltas.append(_chord_delta(self.top, state))
+        self.top = state
+        if len(self) > self.max_size:
+            for freq, _, after in self.deltas.popleft():
+                _set_note(self.bottom, freq, after)
+
+    def pop(self):
+        chord = [(freq, volume, voice_num) for freq, (volume, voice_num) in self.top.items()]
+        if not self.deltas:
+            self.bottom = self.top = None
+            return chord
+        for freq, before, _ in self.deltas.pop():
+            _set_note(self.top, freq, before)
+        return chord
+
+    def chords(self):
+        """All the chords, from the bottom."""
+        if self.bottom is None:
+            return []
+        state = dict(self.bottom)
+        chords = [list(self.bottom.items())]
+        for delta in self.deltas:
+            for freq, _, after in delta:
+                _set_note(state, freq, after)
+            chords.append(list(state.items()))
+        return [[(freq, volume, voice_num) for freq, (volume, voice_num) in chord] for chord in chords]
+
+
+def _set_note(state, freq, note):
+    if note is None:
+        del state[freq]
+    else:
+        state[freq] = note
+
 
 class UndoHandler:
-    def __init__(self, history=[]):
-        self.history = history
-        self.redo_stack = []
+    def __init__(self, history=[], max_steps=10000):
+        # * history is copied, the save changes only when the whole history is saved
+        self.history = ChordStack(max_steps)
+        self.redo_stack = ChordStack(max_steps)
+        for item in history:
+            self.save(item)
 
     def save(self, item):
-        self.history.append(item)
+        # undo skips repeated chords anyway
+        if self.history.top == _chord_state(item):
+            return
+        self.history.push(item)
         # # saving clears redo stack
         # self.redo_stack = []
 
     def undo(self, current_state):
-        self.redo_stack.append(current_state)
+        self.redo_stack.push(current_state)
 
+        current_state = _chord_state(current_state)
         while self.history:
-            item = self.history.pop()
-            if item == current_state:
+            if self.history.top == current_state:
+                self.history.pop()
                 continue
-            return item
+            return self.history.pop()
         return None
 
     def redo(self, current_state):
-        self.history.append(current_state)
+        self.history.push(current_state)
 
+        current_state = _chord_state(current_state)
         while self.redo_stack:
-            item = self.redo_stack.pop()
-            if item == current_state:
+            if self.redo_stack.top == current_state:
+                self.redo_stack.pop()
                 continue
-            return item
+            return self.redo_stack.pop()
         return None
-    
+
     def get_whole_histroy(self, current_state):
-        return self.history + [current_state] + list(reversed(self.redo_stack))
+        return self.history.chords() + [current_state] + list(reversed(self.redo_stack.chords()))
@@ -0,0 +1,94 @@
+from collections import OrderedDict, defaultdict
+from fractions import Fraction
+
+# fmt: off
+gestalt_ratios = [
+    (2,1), (3,1), (4,1), (5,1), (6,1), (7,1), (8,1),
+    (3,2), (5,2), (7,2),
+    (4,3), (5,3), (7,3), (8,3),
+    (5,4), (7,4),
+    (6,5), (7,5), (8,5),
+    (7,6),
+    (8,7),
+]
+# fmt: on
+
+
+class GestaltAnalyzer:
+    """Finds harmonic gestalts - groups of notes which are low harmonics of a common base note.
+
+    Two notes bind when their ratio, reduced to an exact (a, b) integer pair,
+    is one of the ratios. The base note of the pair is then high / a == low / b.
+    Bindings are updated incrementally as notes are added and removed, and the
+    gestalts built from them are remembered for the last cache_size chords.
+    """
+
+    def __init__(self, ratios=gestalt_ratios, cache_size=256):
+        self.ratios = set(ratios)
+        self.cache_size = cache_size
+        self.notes = set()
+        # (low, high) -> base note, for every bound pair of notes
+        self.bindings = dict()
+        # note -> the other notes it is bound with
+        self.partners = defaultdict(set)
+        # frozenset of notes -> (gestalts, affiliations)
+        self._cache = OrderedDict()
+
+    def _base_note(self, freq1, freq2):
+        low, high = sorted([Fraction(freq1), Fraction(freq2)])
+        ratio = high / low
+        if (ratio.numerator, ratio.denominator) not in self.ratios:
+            return None
+        return high / ratio.numerator
+
+    def add_note(self, freq):
+        if freq in self.notes:
+            return
+        for other in self.notes:
+            base_note = self._base_note(freq, other)
+            if base_note is None:
+                continue
+            self.bindings[(min(freq, other), max(freq, other))] = base_note
+            self.partners[freq].add(other)
+            self.partners[other].add(freq)
+        self.notes.add(freq)
+
+    def remove_note(self, freq):
+        if freq not in self.notes:
+            return
+        for other in self.partners.pop(freq, set()):
+            del self.bindings[(min(freq, other), max(freq, other))]
+            self.partners[other].discard(freq)
+        self.notes.remove(freq)
+
+    def set_chord(self, freqs):
+        # only the difference to the current chord is recomputed
+        freqs = set(freqs)
+        for freq in self.notes - freqs:
+            self.remove_note(freq)
+        for freq in freqs - self.notes:
+            self.add_note(freq)
+
+    def get_gestalts(self):
+        """Gestalts of the current notes.
+
+        Returns (gestalts, affiliations): for each base note the set of its
+        harmonics in the chord, and for each note the set of base notes of the
+        gestalts it's in. Base notes are Fractions.
+        """
+        key = frozenset(self.notes)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        gestalts = defaultdict(set)
+        affiliations = defaultdict(set)
+        for (low, high), base_note in self.bindings.items():
+            gestalts[base_note].update([low, high])
+            affiliations[low].add(base_note)
+            affiliations[high].add(base_note)
+
+        self._cache[key] = (dict(gestalts), dict(affiliations))
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return self._cache[key]
@@ -0,0 +1,320 @@
+import math
+import os
+import pathlib
+import shutil
+from collections import defaultdict
+
+import numpy as np
+
+tables_dir = pathlib.Path(__file__).parent.parent / "data"
+
+
+def smallest_prime_factors(n_limit):
+    """Sieve of the smallest prime factor of every number up to n_limit.
+
+    spf[n] is the smallest prime dividing n, so any n can be factorized by
+    dividing it by spf[n] until it gets to 1. spf[0] is 0 and spf[1] is 1.
+    """
+    spf = np.zeros(n_limit + 1, dtype=np.int32)
+    for p in range(2, math.isqrt(n_limit) + 1):
+        if spf[p] == 0:
+            # p is a prime - the smaller multiples already have smaller factors
+            multiples = spf[p * p :: p]
+            multiples[multiples == 0] = p
+    # what's left are primes
+    is_prime = spf == 0
+    is_prime[:2] = False
+    spf[is_prime] = np.flatnonzero(is_prime)
+    spf[1 : min(2, n_limit + 1)] = 1
+    return spf
+
+
+def load_smallest_prime_factors(n_limit, path=tables_dir / "smallest_prime_factors.npy"):
+    """Like smallest_prime_factors, but reuses the sieve saved by the previous runs.
+
+    The sieve is computed again, and saved, only if the saved one is too short.
+    """
+    if os.path.isfile(path):
+        spf = np.load(path, mmap_mode="r")
+        if len(spf) > n_limit:
+            return spf[: n_limit + 1]
+    spf = smallest_prime_factors(n_limit)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # write to a temporary file first, so that other runs never read a half written one
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        np.save(f, spf)
+    os.replace(temp_path, path)
+    return spf
+
+
+def primes_up_to(limit, spf=None):
+    if spf is None:
+        spf = smallest_prime_factors(limit)
+    candidates = np.arange(2, limit + 1)
+    return candidates[spf[2 : limit + 1] == candidates].tolist()
+
+
+def decompose_into_small_primes(n, primes=[2, 3, 5, 7], spf=None):
+    factors = np.zeros_like(primes)
+    if spf is not None and n < len(spf):
+        # * walk down the smallest prime factors instead of trying every prime
+        while n != 1:
+            prime = spf[n]
+            if prime not in primes:
+                return None
+            factors[primes.index(prime)] += 1
+            n //= prime
+        return factors
+    while n != 1:
+        updated = False
+        for i, prime in enumerate(primes):
+            if n % prime == 0:
+                n /= prime
+                factors[i] += 1
+                updated = True
+        if not updated:
+            # n cannot be decomposed into those primes
+            return None
+    return factors
+
+
+def factorize_up_to(n_limit, primes, spf=None):
+    """Decompose all the numbers up to n_limit into the given primes at once.
+
+    Uses the spf sieve (computed if not given): n has the factors of n / spf[n]
+    and one more factor spf[n]. Numbers in [k, 2k) only look back at numbers
+    below k, so each such range is done in one vectorized step. Returns
+    (numbers, exponents) - only the numbers which are products of the given
+    primes, and their exponents with one row per number.
+    """
+    if spf is None:
+        spf = smallest_prime_factors(n_limit)
+    spf = np.asarray(spf[: n_limit + 1])
+    # prime -> its column in exponents, -1 for other primes
+    columns = np.full(n_limit + 1, -1, dtype=np.int64)
+    primes_in_range = [prime for prime in primes if prime <= n_limit]
+    columns[primes_in_range] = [primes.index(prime) for prime in primes_in_range]
+
+    decomposable = np.zeros(n_limit + 1, dtype=bool)
+    decomposable[1 : min(2, n_limit + 1)] = True
+    # exponents never get above log2(n_limit), so int8 is plenty
+    exponents = np.zeros((n_limit + 1, len(primes)), dtype=np.int8)
+    start = 2
+    while start <= n_limit:
+        end = min(2 * start, n_limit + 1)
+        factors = spf[start:end]
+        quotients = np.arange(start, end) // factors
+        factor_columns = columns[factors]
+        found = decomposable[quotients] & (factor_columns >= 0)
+        decomposable[start:end] = found
+        found_numbers = np.flatnonzero(found) + start
+        exponents[found_numbers] = exponents[quotients[found]]
+        exponents[found_numbers, factor_columns[found]] += 1
+        start = end
+    numbers = np.flatnonzero(decomposable)
+    return numbers, exponents[numbers].astype(np.int64)
+
+
+def extend_placement(placement_matrix, primes):
+    """Placement matrix with a column for each of the primes.
+
+    The first primes use the columns of placement_matrix. Further primes are
+    placed log2(prime) to the right, and up or down by offsets spread with the
+    golden ratio, so that their directions don't overlap.
+    """
+    golden = (np.sqrt(5) - 1) / 2
+    num_given = min(len(primes), placement_matrix.shape[1])
+    columns = [placement_matrix[:, i] for i in range(num_given)]
+    for i in range(num_given, len(primes)):
+        offset = (i * golden) % 1
+        columns.append(np.array([np.log2(primes[i]), 1.6 * offset - 0.8]))
+    return np.stack(columns, axis=1)
+
+
+def find_ratio_edges(numbers, a, b):
+    """All pairs (n1, n2) of the given numbers with n2 / n1 == a / b.
+
+    Uses integer lookups instead of comparing every pair of numbers.
+    Returns two arrays, n1s and n2s.
+    """
+    divisor = math.gcd(a, b)
+    a, b = a // divisor, b // divisor
+    is_present = np.zeros(numbers.max() + 1, dtype=bool)
+    is_present[numbers] = True
+
+    # n2 is an integer only if n1 is divisible by b
+    n1s = numbers[numbers % b == 0]
+    n2s = n1s // b * a
+    in_range = n2s < len(is_present)
+    n1s, n2s = n1s[in_range], n2s[in_range]
+    present = is_present[n2s]
+    return n1s[present], n2s[present]
+
+
+class SpatialGrid:
+    """Uniform grid over 2D points, for finding the point near a given position.
+
+    Each cell lists the points inside it. With the cell size at least the
+    search radius, a lookup only checks the 3x3 cells around the position.
+    """
+
+    def __init__(self, positions, cell_size):
+        self.positions = np.asarray(positions, dtype=float)
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+        cell_coords = np.floor(self.positions / cell_size).astype(np.int64)
+        for i, cell in enumerate(map(tuple, cell_coords.tolist())):
+            self.cells[cell].append(i)
+
+    def find_nearest(self, position, radius):
+        """Index of the point nearest to position, if it's closer than radius, else None."""
+        cell_x, cell_y = np.floor(np.asarray(position) / self.cell_size).astype(np.int64)
+        candidates = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                candidates += self.cells.get((cell_x + dx, cell_y + dy), [])
+        if not candidates:
+            return None
+        distances = np.linalg.norm(self.positions[candidates] - position, axis=1)
+        nearest = np.argmin(distances)
+        if distances[nearest] >= radius:
+            return None
+        return candidates[nearest]
+
+    def find_in_rect(self, low, high):
+        """Indexes of the points inside the rectangle with corners low and high."""
+        low, high = np.asarray(low), np.asarray(high)
+        cell_low = np.floor(low / self.cell_size).astype(np.int64)
+        cell_high = np.floor(high / self.cell_size).astype(np.int64)
+        num_cells = np.prod(np.maximum(cell_high - cell_low + 1, 0))
+        if num_cells > len(self.cells):
+            # a big rectangle, cheaper to check all the points at once
+            candidates = np.arange(len(self.positions))
+        else:
+            candidates = []
+            for cell_x in range(cell_low[0], cell_high[0] + 1):
+                for cell_y in range(cell_low[1], cell_high[1] + 1):
+                    candidates += self.cells.get((cell_x, cell_y), [])
+            candidates = np.array(sorted(candidates), dtype=np.int64)
+        positions = self.positions[candidates]
+        inside = np.all((positions >= low) & (positions <= high), axis=1)
+        return candidates[inside]
+
+
+class Lattice:
+    """Numbers connected by simple ratios, kept in flat arrays.
+
+    Nodes are indexed 0..N-1, in increasing order of their numbers. Edge e
+    connects nodes edge_nodes[e] and its kind, edge_kinds[e], is the index of
+    its ratio. Adjacency is in CSR form: node i's neighbors are
+    neighbors[neighbor_ptr[i] : neighbor_ptr[i + 1]], reached through the edges
+    at the same positions of neighbor_edges.
+    """
+
+    def __init__(self, numbers, exponents, edge_nodes, edge_kinds):
+        self.numbers = numbers
+        self.exponents = exponents
+        self.edge_nodes = edge_nodes
+        self.edge_kinds = edge_kinds
+        self.active = np.zeros(len(numbers), dtype=bool)
+
+        # number -> node index, -1 for numbers which are not in the lattice
+        self.node_indexes = np.full(numbers.max(initial=0) + 1, -1, dtype=np.int64)
+        self.node_indexes[numbers] = np.arange(len(numbers))
+
+        num_edges = len(edge_nodes)
+        ends = np.concatenate([edge_nodes[:, 0], edge_nodes[:, 1]])
+        other_ends = np.concatenate([edge_nodes[:, 1], edge_nodes[:, 0]])
+        order = np.argsort(ends, kind="stable")
+        self.neighbors = other_ends[order]
+        self.neighbor_edges = np.tile(np.arange(num_edges), 2)[order]
+        self.neighbor_ptr = np.zeros(len(numbers) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(ends, minlength=len(numbers)), out=self.neighbor_ptr[1:])
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def index(self, n):
+        """Node index of the number n, or None if it's not in the lattice."""
+        if not 0 <= n < len(self.node_indexes) or n != int(n):
+            return None
+        i = self.node_indexes[int(n)]
+        return int(i) if i >= 0 else None
+
+    def neighbors_of(self, i):
+        """Node indexes of the neighbors of node i, and the indexes of the edges to them."""
+        start, end = self.neighbor_ptr[i], self.neighbor_ptr[i + 1]
+        return self.neighbors[start:end], self.neighbor_edges[start:end]
+
+    def active_edges(self):
+        return self.active[self.edge_nodes[:, 0]] & self.active[self.edge_nodes[:, 1]]
+
+    def save(self, path, **extra_arrays):
+        """Save the lattice, and any extra arrays, as a directory of .npy files."""
+        arrays = dict(
+            numbers=self.numbers,
+            exponents=self.exponents,
+            edge_nodes=self.edge_nodes,
+            edge_kinds=self.edge_kinds,
+            node_indexes=self.node_indexes,
+            neighbors=self.neighbors,
+            neighbor_edges=self.neighbor_edges,
+            neighbor_ptr=self.neighbor_ptr,
+            **extra_arrays,
+        )
+        # write to a temporary directory first, so that other runs never read a half written one
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        os.makedirs(temp_path)
+        for name, array in arrays.items():
+            np.save(os.path.join(temp_path, f"{name}.npy"), array)
+        try:
+            os.replace(temp_path, path)
+        except OSError:
+            # another run has saved it in the meantime
+            shutil.rmtree(temp_path)
+
+    @classmethod
+    def load(cls, path):
+        """Load a lattice saved with save, memory-mapping the arrays instead of reading them.
+
+        Returns (lattice, extra_arrays).
+        """
+        arrays = dict()
+        for filename in os.listdir(path):
+            name, _ = os.path.splitext(filename)
+            arrays[name] = np.load(os.path.join(path, filename), mmap_mode="r")
+        lattice = cls.__new__(cls)
+        for name in [
+            "numbers",
+            "exponents",
+            "edge_nodes",
+            "edge_kinds",
+            "node_indexes",
+            "neighbors",
+            "neighbor_edges",
+            "neighbor_ptr",
+        ]:
+            setattr(lattice, name, arrays.pop(name))
+        lattice.active = np.zeros(len(lattice.numbers), dtype=bool)
+        return lattice, arrays
+
+
+def build_lattice(n_limit, primes, ratios, avoid_numbers=(), spf=None):
+    """Lattice of numbers up to n_limit made of the given primes.
+
+    Numbers are connected when they are in one of the ratios, which are
+    (a, b) pairs; the edge kind is the index of the ratio in this list.
+    """
+    numbers, exponents = factorize_up_to(n_limit, primes, spf)
+    not_avoided = ~np.isin(numbers, list(avoid_numbers))
+    numbers, exponents = numbers[not_avoided], exponents[not_avoided]
+
+    edge_nodes = [np.zeros((0, 2), dtype=np.int64)]
+    edge_kinds = [np.zeros(0, dtype=np.int64)]
+    for kind, (a, b) in enumerate(ratios):
+        n1s, n2s = find_ratio_edges(numbers, a, b)
+        # numbers are sorted, so their node indexes can be found by bisection
+        edge_nodes.append(np.stack([np.searchsorted(numbers, n1s), np.searchsorted(numbers, n2s)], axis=1))
+        edge_kinds.append(np.full(len(n1s), kind))
+    return Lattice(numbers, exponents, np.concatenate(edge_nodes), np.concatenate(edge_kinds))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import argparse
+import time
+
+from storage import SqliteBackend, data_dir
+
+
+def print_chords(chords):
+    for save_name, keyname, step, freqs in chords:
+        where = f"history step {step}" if step is not None else f"key {keyname}"
+        print(f"{save_name} ({where}): {freqs}")
+    print(f"\n{len(chords)} chords")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Query the chord library kept in saved_chords.sqlite (see --storage sqlite)",
+    )
+    parser.add_argument(
+        "--database",
+        type=str,
+        default=str(data_dir / "saved_chords.sqlite"),
+        help="path of the SQLite database",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="copy all the saves from a saved_chords.txt file")
+    import_parser.add_argument(
+        "path",
+        type=str,
+        nargs="?",
+        default=str(data_dir / "saved_chords.txt"),
+        help="JSON lines file to import",
+    )
+    ratio_parser = subparsers.add_parser("ratio", help="chords containing two notes in the ratio A:B")
+    ratio_parser.add_argument("numerator", type=int)
+    ratio_parser.add_argument("denominator", type=int)
+    notes_parser = subparsers.add_parser("notes", help="chords made of exactly these notes")
+    notes_parser.add_argument("freqs", type=int, nargs="+")
+    max_note_parser = subparsers.add_parser("max-note", help="saves which use only notes up to N")
+    max_note_parser.add_argument("max_freq", type=int)
+    args = parser.parse_args()
+
+    library = SqliteBackend(args.database)
+    start_time = time.time()
+    if args.command == "import":
+        num_saves = library.import_json_lines(args.path)
+        print(f"imported {num_saves} saves")
+    elif args.command == "ratio":
+        print_chords(library.chords_with_ratio(args.numerator, args.denominator))
+    elif args.command == "notes":
+        print_chords(library.chords_with_notes(args.freqs))
+    elif args.command == "max-note":
+        save_names = library.saves_with_notes_up_to(args.max_freq)
+        for save_name in save_names:
+            print(save_name)
+        print(f"\n{len(save_names)} saves")
+    print(f"took {time.time() - start_time:.3f}s")
+    library.close()
@@ -1,9 +1,10 @@
 import time
+import queue
 import threading
 import dataclasses
+from collections import defaultdict
 
 import numpy as np
-import sounddevice
 
 
 BIT_RATE = 48000
@@ -17,143 +18,657 @@ class Note:
     voice_num: int
 
 
+# * commands sent from the UI thread to the player thread
+
+
+@dataclasses.dataclass
+class AddNote:
+    note: Note
+
+
+@dataclasses.dataclass
+class RemoveNote:
+    freq: float
+
+
+@dataclasses.dataclass
+class MoveNote:
+    old_freq: float
+    new_freq: float = None
+    volume_change: float = None
+
+
+@dataclasses.dataclass
+class SetChord:
+    notes: dict  # voice_num -> Note
+
+
+@dataclasses.dataclass
+class TurnOffAll:
+    pass
+
+
+def human_corrected_amplitude(frequency):
+    # works both for a single frequency and for an array of them
+    low_limit = 300
+    slope = -1.0
+    rescaled = np.maximum(frequency / low_limit, 1)
+    return rescaled**slope
+
+
+# relative amplitudes of consecutive harmonics, roughly following the spectra from
+# stackoverflow.com/questions/10702942/note-synthesis-harmonics-violin-piano-guitar-bass-frequencies-midi
+timbres = dict(
+    sine=[1],
+    violin=[1.0, 0.29, 0.15, 0.04, 0.2, 0.23, 0.22, 0.0, 0.14, 0.0, 0.02, 0.04],
+    piano=[1.0, 0.34, 0.11, 0.07, 0.06, 0.05, 0.01, 0.02, 0.01, 0.01, 0.01],
+    organ=[1.0, 0.5, 0.25, 0.12, 0.06, 0.03, 0.02, 0.01],
+)
+
+
+class Wavetable:
+    """One period of a timbre, in variants with 1, 2, 4, ... harmonics, so high notes don't alias."""
+
+    size = 2048
+
+    def __init__(self, harmonic_amplitudes):
+        amplitudes = np.asarray(harmonic_amplitudes, dtype=float)
+        num_harmonics = len(amplitudes)
+        limits = {2**k for k in range(num_harmonics.bit_length())} | {num_harmonics}
+        self.harmonic_limits = np.array(sorted(limits))
+
+        # one extra sample at the end, so interpolation doesn't need to wrap around
+        angles = 2 * np.pi * np.arange(self.size + 1) / self.size
+        tables = [
+            amplitudes[:limit] @ np.sin(np.multiply.outer(np.arange(1, limit + 1), angles))
+            for limit in self.harmonic_limits
+        ]
+        # the same scaling for all variants, so that dropping harmonics doesn't boost the volume
+        self.tables = np.array(tables) / np.max(np.abs(tables[-1]))
+        self._scratch = None
+
+    def lookup(self, phases, frequencies, sample_rate=BIT_RATE, out=None):
+        """Interpolate the table at phases (voices x samples), in the variant for each frequency."""
+        num_voices, num_samples = phases.shape
+        if out is None:
+            out = np.empty(phases.shape)
+        scratch = self._scratch
+        if scratch is None or scratch[0].shape[1] != num_samples or len(scratch[0]) < num_voices:
+            shape = phases.shape
+            scratch = (np.empty(shape), np.empty(shape), np.empty(shape, dtype=np.intp), np.ones((1, num_samples)))
+            self._scratch = scratch
+        fractions, right, indexes = (array[:num_voices] for array in scratch[:3])
+        ones_row = scratch[3]
+
+        max_harmonics = (sample_rate / 2) / np.maximum(frequencies, 1e-9)
+        levels = np.searchsorted(self.harmonic_limits, max_harmonics, side="right") - 1
+        levels = np.maximum(levels, 0)
+
+        np.multiply(phases, self.size / (2 * np.pi), out=fractions)
+        np.mod(fractions, self.size, out=fractions)
+        np.floor(fractions, out=right)
+        fractions -= right
+        # index straight into the flattened tables, each voice into its own variant
+        # (offsets added with a matrix product, because broadcasting allocates a buffer)
+        level_offsets = (levels * self.tables.shape[1]).astype(float)[:, None]
+        right += np.matmul(level_offsets, ones_row, out=out)
+        np.copyto(indexes, right, casting="unsafe")
+        # ! "raise" mode would copy out, the indexes are in range anyway
+        tables = self.tables.ravel()
+        np.take(tables, indexes, out=out, mode="clip")
+        indexes += 1
+        np.take(tables, indexes, out=right, mode="clip")
+        # out = left + fractions * (right - left)
+        right -= out
+        right *= fractions
+        out += right
+        return out
+
+
+class OscillatorBank:
+    """All the voices in slots 0..size-1 of contiguous arrays, rendered together as one matrix."""
+
+    def __init__(
+        self,
+        base_freq,
+        timbre=None,
+        sample_rate=BIT_RATE,
+        attack_time=0.01,
+        release_time=0.03,
+        glide_time=0.01,
+        capacity=32,
+    ):
+        self.base_freq = base_freq
+        self.wavetable = Wavetable(timbres[timbre]) if timbre is not None else None
+        self.sample_rate = sample_rate
+        # time constants, indexed by the releasing flag
+        self.envelope_times = np.maximum([attack_time, release_time], 1e-6)
+        self.glide_time = max(glide_time, 1e-6)
+
+        self.size = 0
+        # * freqs and volumes are the targets, what the rest of the app sees
+        self.freqs = np.zeros(capacity)  # in multiples of base_freq
+        self.volumes = np.zeros(capacity)
+        self.phases = np.zeros(capacity)
+        self.voice_nums = np.zeros(capacity, dtype=np.int64)
+        # * current state of the smoothing
+        self.glide_freqs = np.zeros(capacity)  # in multiples of base_freq
+        self.gains = np.zeros(capacity)
+        self.releasing = np.zeros(capacity, dtype=bool)
+
+        # releasing voices are not indexed
+        self.slots = dict()  # voice_num -> slot
+        self.voices_by_freq = defaultdict(set)  # freq -> voice_nums
+        self._buffers_shape = None
+
+    def _arrays(self):
+        return (
+            self.freqs,
+            self.volumes,
+            self.phases,
+            self.voice_nums,
+            self.glide_freqs,
+            self.gains,
+            self.releasing,
+        )
+
+    def add(self, freq, volume, phase, voice_num):
+        if self.size == len(self.freqs):
+            # double the capacity, so that adding notes is amortized O(1)
+            (
+                self.freqs,
+                self.volumes,
+                self.phases,
+                self.voice_nums,
+                self.glide_freqs,
+                self.gains,
+                self.releasing,
+            ) = (np.concatenate([array, np.zeros_like(array)]) for array in self._arrays())
+        slot = self.size
+        self.freqs[slot] = freq
+        self.volumes[slot] = volume
+        self.phases[slot] = phase
+        self.voice_nums[slot] = voice_num
+        # start silent and fade in, so there is no click whatever the phase
+        self.glide_freqs[slot] = freq
+        self.gains[slot] = 0
+        self.releasing[slot] = False
+        self.slots[voice_num] = slot
+        self.voices_by_freq[freq].add(voice_num)
+        self.size += 1
+
+    def release(self, slot):
+        # the voice fades out and is removed after rendering, when it gets silent
+        voice_num = int(self.voice_nums[slot])
+        del self.slots[voice_num]
+        self._unindex_freq(float(self.freqs[slot]), voice_num)
+        self.releasing[slot] = True
+
+    def remove(self, slot):
+        if not self.releasing[slot]:
+            self.release(slot)
+        # move the last voice into the freed slot, so the arrays stay contiguous
+        last = self.size - 1
+        if slot != last:
+            for array in self._arrays():
+                array[slot] = array[last]
+            if not self.releasing[slot]:
+                self.slots[int(self.voice_nums[slot])] = slot
+        self.size -= 1
+
+    def set_freq(self, slot, freq):
+        voice_num = int(self.voice_nums[slot])
+        self._unindex_freq(float(self.freqs[slot]), voice_num)
+        self.freqs[slot] = freq
+        self.voices_by_freq[freq].add(voice_num)
+
+    def _unindex_freq(self, freq, voice_num):
+        voices = self.voices_by_freq[freq]
+        voices.discard(voice_num)
+        if not voices:
+            del self.voices_by_freq[freq]
+
+    def find_voice(self, voice_num):
+        return self.slots.get(voice_num)
+
+    def find_freq(self, freq):
+        voices = self.voices_by_freq.get(freq)
+        if not voices:
+            return None
+        return self.slots[next(iter(voices))]
+
+    def get_chord(self):
+        chord = []
+        for voice_num, slot in self.slots.items():
+            freq = float(self.freqs[slot])
+            # freqs are stored as floats, but the rest of the app uses ints for them
+            freq = int(freq) if freq.is_integer() else freq
+            chord.append((freq, float(self.volumes[slot]), voice_num))
+        return chord
+
+    def _prepare_buffers(self, num_samples):
+        # * envelope_curves[i, k] - how much of the distance to the target gain
+        # *     is left after k samples, with the i-th time constant
+        # * glide_curve[k] - integral of the remaining fraction of the glide, in samples
+        # the curves only depend on the block size, so they are computed once
+        ks = np.arange(num_samples + 1)
+        envelope_decays = np.exp(-1 / (self.envelope_times * self.sample_rate))
+        glide_decay = np.exp(-1 / (self.glide_time * self.sample_rate))
+        self.envelope_curves = np.power.outer(envelope_decays, ks)
+        self.glide_curve = (1 - glide_decay**ks) / (1 - glide_decay)
+        self._glide_remaining = glide_decay**num_samples
+        # phases of a voice are its coefficients @ phase_basis (step * k + phase + glide),
+        # one matrix product for all voices, with no broadcasting
+        self._phase_basis = np.stack([ks[:-1].astype(float), np.ones(num_samples), self.glide_curve[:-1]])
+        # * scratch buffers, so that rendering a block allocates nothing of its size
+        # * the voice x sample ones have a row for each slot, and use the first size rows
+        capacity = len(self.freqs)
+        self._phase_matrix = np.empty((capacity, num_samples))
+        self._wave_matrix = np.empty((capacity, num_samples))
+        self._envelope_sounds = np.empty((len(self.envelope_times), num_samples))
+        self._sound = np.empty(num_samples)
+        self._buffers_shape = (capacity, num_samples)
+
+    def render(self, num_samples):
+        """Sound of the next num_samples samples of all voices.
+
+        The returned array is reused by the next render.
+        """
+        if self._buffers_shape != (len(self.freqs), num_samples):
+            self._prepare_buffers(num_samples)
+        n = self.size
+        releasing = self.releasing[:n]
+        target_freqs = self.freqs[:n] * self.base_freq
+        start_freqs = self.glide_freqs[:n] * self.base_freq
+        target_gains = self.volumes[:n] * human_corrected_amplitude(target_freqs) * ~releasing
+        start_gains = self.gains[:n]
+
+        # ! phases, with frequencies gliding exponentially to the targets
+        # one row per voice
+        freq_steps = target_freqs * (2 * np.pi / self.sample_rate)
+        glide_steps = (start_freqs - target_freqs) * (2 * np.pi / self.sample_rate)
+        phase_coefficients = np.stack([freq_steps, self.phases[:n], glide_steps], axis=1)
+        phases = np.matmul(phase_coefficients, self._phase_basis, out=self._phase_matrix[:n])
+        waves = self._wave_matrix[:n]
+        gliding = np.any(glide_steps != 0)
+        if self.wavetable is None:
+            np.sin(phases, out=waves)
+        else:
+            self.wavetable.lookup(phases, np.maximum(start_freqs, target_freqs), self.sample_rate, out=waves)
+
+        # ! gains, approaching the targets exponentially
+        # the sum over voices of (target + (start - target) * curve) * wave,
+        # grouped by curve, so it's a few matrix products instead of a gain matrix
+        sound = np.matmul(target_gains, waves, out=self._sound)
+        gain_distances = np.zeros((len(self.envelope_times), n))
+        gain_distances[releasing.astype(np.intp), np.arange(n)] = start_gains - target_gains
+        envelope_sounds = np.matmul(gain_distances, waves, out=self._envelope_sounds)
+        envelope_sounds *= self.envelope_curves[:, :-1]
+        for envelope_sound in envelope_sounds:
+            sound += envelope_sound
+
+        # ! advance the state of all voices at once
+        self.phases[:n] += freq_steps * num_samples
+        if gliding:
+            self.phases[:n] += glide_steps * self.glide_curve[-1]
+            glide_distances = self.glide_freqs[:n] - self.freqs[:n]
+            self.glide_freqs[:n] = self.freqs[:n] + glide_distances * self._glide_remaining
+            # snap to the target once the difference is inaudible
+            close = np.abs(self.glide_freqs[:n] - self.freqs[:n]) < 1e-6
+            self.glide_freqs[:n][close] = self.freqs[:n][close]
+        np.mod(self.phases[:n], 2 * np.pi, out=self.phases[:n])
+        self.gains[:n] = target_gains + (start_gains - target_gains) * self.envelope_curves[
+            releasing.astype(np.intp), -1
+        ]
+
+        # ! drop the voices which faded out
+        for slot in reversed(np.flatnonzero(releasing & (self.gains[:n] < 1e-4))):
+            self.remove(slot)
+        return sound
+
+
+class RingBuffer:
+    """Preallocated ring of float32 samples, for one writer and one reader thread, without a lock."""
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.buffer = np.zeros(capacity, dtype=np.float32)
+        self.write_pos = 0
+        self.read_pos = 0
+
+    def available(self):
+        return self.write_pos - self.read_pos
+
+    def free(self):
+        return self.capacity - self.available()
+
+    def write(self, samples):
+        # the caller must check free() first
+        n = len(samples)
+        start = self.write_pos % self.capacity
+        first_part = min(n, self.capacity - start)
+        self.buffer[start : start + first_part] = samples[:first_part]
+        self.buffer[: n - first_part] = samples[first_part:]
+        self.write_pos += n
+
+    def read_into(self, out):
+        # fills out with as many samples as there are, the rest with silence
+        n = min(len(out), self.available())
+        start = self.read_pos % self.capacity
+        first_part = min(n, self.capacity - start)
+        out[:first_part] = self.buffer[start : start + first_part]
+        out[first_part:n] = self.buffer[: n - first_part]
+        out[n:] = 0
+        self.read_pos += n
+        return n
+
+
+class PlayerStats:
+    """Counters and histograms of the player thread, for diagnosing stutters."""
+
+    # upper edges of histogram bins, log-spaced from 1 us to 1 s, in ns
+    time_bins = np.logspace(3, 9, 61)
+
+    def __init__(self):
+        self.blocks = 0
+        # * underruns - the ring buffer ran dry and the callback had to pad with silence
+        # * stream_underflows - the audio driver reported it didn't get samples in time
+        # * overruns - rendering a block took longer than playing it
+        self.underruns = 0
+        self.stream_underflows = 0
+        self.overruns = 0
+        self.active_voices = 0
+        self.peak_level = 0.0
+        self.max_peak_level = 0.0
+        # the last bin counts everything above 1 s
+        self.render_times = np.zeros(len(self.time_bins) + 1, dtype=np.int64)
+        self.write_times = np.zeros(len(self.time_bins) + 1, dtype=np.int64)
+
+    def record_render(self, render_time, block_duration, active_voices, peak_level):
+        self.render_times[np.searchsorted(self.time_bins, render_time)] += 1
+        if render_time > block_duration * 1e9:
+            self.overruns += 1
+        self.active_voices = active_voices
+        self.peak_level = peak_level
+        self.max_peak_level = max(self.max_peak_level, peak_level)
+        self.blocks += 1
+
+    def record_idle(self):
+        # nothing is playing, so nothing was rendered
+        self.active_voices = 0
+        self.peak_level = 0.0
+
+    def record_write(self, write_time):
+        self.write_times[np.searchsorted(self.time_bins, write_time)] += 1
+
+    def _percentile_ms(self, histogram, q):
+        # upper edge of the bin holding the q-th quantile
+        counts = np.cumsum(histogram)
+        if counts[-1] == 0:
+            return 0.0
+        i = np.searchsorted(counts, q * counts[-1])
+        return float(self.time_bins[min(i, len(self.time_bins) - 1)]) / 1e6
+
+    def snapshot(self, queue_depth=0):
+        render_times = self.render_times.copy()
+        write_times = self.write_times.copy()
+        return dict(
+            blocks=self.blocks,
+            underruns=self.underruns,
+            stream_underflows=self.stream_underflows,
+            overruns=self.overruns,
+            queue_depth=queue_depth,
+            active_voices=self.active_voices,
+            peak_level=self.peak_level,
+            max_peak_level=self.max_peak_level,
+            render_ms_p50=self._percentile_ms(render_times, 0.5),
+            render_ms_p99=self._percentile_ms(render_times, 0.99),
+            write_ms_p50=self._percentile_ms(write_times, 0.5),
+            write_ms_p99=self._percentile_ms(write_times, 0.99),
+            render_times=render_times,
+            write_times=write_times,
+        )
+
+
 class PolyphonicPlayer(threading.Thread):
-    segment_duration = 0.010  # in seconds
+    """Plays the notes on a separate thread.
+
+    There are three output modes:
+    - "blocking" - this thread renders a block and writes it to the stream,
+    - "callback" - this thread renders ahead into a ring buffer, and the sound
+      card pulls from it in a callback, so a busy GIL doesn't starve the output.
+      latency is how many seconds of sound are rendered ahead.
+    - "offline" - no audio device is opened and the thread is not started,
+      sound is pulled with render_offline instead.
+
+    block_size is the number of samples rendered at once, and also per stream
+    write or callback (by default segment_duration worth of samples). Mono sound
+    is copied to all the channels.
+
+    timbre is one of the names in timbres, or None for plain sine waves.
+    """
+
+    segment_duration = 0.010  # default block duration, in seconds
 
-    def __init__(self, base_freq=10, master_volume=0.05):
+    def __init__(
+        self,
+        base_freq=10,
+        master_volume=0.05,
+        output_mode="blocking",
+        sample_rate=BIT_RATE,
+        block_size=None,
+        channels=1,
+        latency=0.05,
+        timbre=None,
+    ):
         threading.Thread.__init__(self)
 
-        self.stream = sounddevice.RawOutputStream(channels=1, samplerate=BIT_RATE)
-        self.stream.start()
+        self.sample_rate = sample_rate
+        if block_size is None:
+            block_size = int(sample_rate * self.segment_duration)
+        self.block_size = block_size
+        self.block_duration = block_size / sample_rate
+        # blocks are rendered straight into this buffer, which then goes to the stream as is
+        self._block = np.zeros((block_size, channels), dtype=np.float32)
+
+        self.output_mode = output_mode
+        if output_mode == "offline":
+            self.stream = None
+        elif output_mode in ["blocking", "callback"]:
+            # imported here, so that offline rendering works without an audio library
+            import sounddevice
+
+            if output_mode == "blocking":
+                self.stream = sounddevice.RawOutputStream(
+                    channels=channels,
+                    samplerate=sample_rate,
+                    dtype="float32",
+                    blocksize=block_size,
+                )
+            else:
+                num_blocks = max(int(np.ceil(latency / self.block_duration)), 1)
+                self.ring_buffer = RingBuffer(num_blocks * block_size)
+                self.stream = sounddevice.OutputStream(
+                    channels=channels,
+                    samplerate=sample_rate,
+                    dtype="float32",
+                    blocksize=block_size,
+                    callback=self._callback,
+                )
+            # the stream is started in run, once there is sound for it
+        else:
+            raise ValueError(f"unknown output mode: {output_mode}")
 
         self.alive = True
         self.base_freq = base_freq
         self.master_volume = master_volume  # lower the volume to avoid clipping
-        self.notes = list()
-        self.notes_to_add = list()
-        self.notes_to_delete = list()
-        self.notes_to_move = list()
-        self.chord_to_set = None
+        self.bank = OscillatorBank(base_freq, timbre=timbre, sample_rate=sample_rate)
+        # * the UI thread never touches self.bank - it sends commands, which the
+        # * player thread applies in one batch before rendering each block
+        self.commands = queue.SimpleQueue()
+        # published by the player thread after each batch, so reading it needs no lock
+        self._chord = []
         self._warned_about_clipping = False
+        self.stats = PlayerStats()
 
     def run(self):
+        mono = self._block[:, 0]
+        if self.output_mode == "callback":
+            # ! fill the ring buffer before starting the stream, otherwise
+            # ! the first callbacks would find it empty and count underruns
+            self._apply_commands()
+            while self.ring_buffer.free() >= self.block_size:
+                self._render_into_ring_buffer(mono)
+        self.stream.start()
+
         while self.alive:
-            # * self.notes should only be modified in this loop
-            # ! add and delete queued notes
-            while self.notes_to_add:
-                note = self.notes_to_add.pop()
-                self.notes.append(note)
-            while self.notes_to_delete:
-                note = self.notes_to_delete.pop()
-                if note in self.notes:
-                    self.notes.remove(note)
-            # ! set a chord
-            if self.chord_to_set is not None:
-                existing_voice_nums = set(note.voice_num for note in self.notes)
-                new_voice_nums = set(self.chord_to_set.keys())
-                voice_nums_to_add = new_voice_nums - existing_voice_nums
-                voice_nums_to_delete = existing_voice_nums - new_voice_nums
-                voice_nums_to_change = new_voice_nums & existing_voice_nums
-                for voice_num in voice_nums_to_add:
-                    self.notes.append(self.chord_to_set[voice_num])
-                for voice_num in voice_nums_to_delete:
-                    self.notes.remove(self._get_note_by_voice_num(voice_num))
-                for voice_num in voice_nums_to_change:
-                    note = self._get_note_by_voice_num(voice_num)
-                    note.freq = self.chord_to_set[voice_num].freq
-                    note.volume = self.chord_to_set[voice_num].volume
-                self.chord_to_set = None
-            # ! move notes
-            while self.notes_to_move:
-                old_freq, new_freq, volume_change = self.notes_to_move.pop()
-                for note in self.notes:
-                    if note.freq == old_freq:
-                        # change this note
-                        if new_freq is not None:
-                            note.freq = new_freq
-                        if volume_change is not None:
-                            note.volume *= volume_change
-                        break
-
-            if len(self.notes) == 0:
-                # no frequencies given so be silent
-                time.sleep(self.segment_duration)
+            self._apply_commands()
+
+            if self.output_mode == "callback":
+                if self.ring_buffer.free() < self.block_size:
+                    # rendered far enough ahead, wait for the callback to catch up
+                    time.sleep(self.block_duration / 2)
+                    continue
+                self._render_into_ring_buffer(mono)
                 continue
 
-            # ! construct a sound
-            final_sound = 0
-            for note in self.notes:
-                final_frequency = note.freq * self.base_freq
-                final_sound += self.get_wave(final_frequency, note.phase) * note.volume
-                # update phase
-                phase_change = self.segment_duration * final_frequency * 2 * np.pi
-                note.phase = (note.phase + phase_change) % (2 * np.pi)
-
-            final_sound *= self.master_volume
-            if np.max(np.abs(final_sound)) > 1 and not self._warned_about_clipping:
-                print("WARNING: sound is clipping - lower the volume")
-                # warn only once
-                self._warned_about_clipping = True
-            # clip the sound to -1..1
-            final_sound = np.clip(final_sound, -1, 1)
-
-            self.stream.write(final_sound.astype(np.float32).tobytes())
+            if not self._render_segment(mono):
+                # no frequencies given so be silent
+                time.sleep(self.block_duration)
+                continue
+            # copy the sound to the other channels
+            self._block[:, 1:] = self._block[:, :1]
+            start = time.perf_counter_ns()
+            if self.stream.write(self._block):
+                self.stats.stream_underflows += 1
+            self.stats.record_write(time.perf_counter_ns() - start)
 
         self.stream.stop()
         self.stream.close()
 
-    def get_wave(self, frequency, phase):
-        ts = np.arange(BIT_RATE * self.segment_duration) / BIT_RATE
-        wave = np.sin(2 * np.pi * frequency * ts + phase)
+    def _render_into_ring_buffer(self, mono):
+        if not self._render_segment(mono):
+            # keep feeding silence, so that it doesn't count as an underrun
+            mono[:] = 0
+        self.ring_buffer.write(mono)
+
+    def _callback(self, outdata, frames, time_info, status):
+        if status.output_underflow:
+            self.stats.stream_underflows += 1
+        if self.ring_buffer.read_into(outdata[:, 0]) < frames:
+            self.stats.underruns += 1
+        outdata[:, 1:] = outdata[:, :1]
+
+    def _apply_commands(self):
+        if self.commands.empty():
+            return
+        while True:
+            try:
+                command = self.commands.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(command, AddNote):
+                self._add(command.note)
+            elif isinstance(command, RemoveNote):
+                slot = self.bank.find_freq(command.freq)
+                if slot is not None:
+                    self.bank.release(slot)
+            elif isinstance(command, MoveNote):
+                slot = self.bank.find_freq(command.old_freq)
+                if slot is None:
+                    continue
+                if command.new_freq is not None:
+                    self.bank.set_freq(slot, command.new_freq)
+                if command.volume_change is not None:
+                    self.bank.volumes[slot] *= command.volume_change
+            elif isinstance(command, SetChord):
+                self._set_chord(command.notes)
+            elif isinstance(command, TurnOffAll):
+                for slot in list(self.bank.slots.values()):
+                    self.bank.release(slot)
+        self._chord = self.bank.get_chord()
+
+    def _add(self, note):
+        while note.voice_num in self.bank.slots:
+            # a voice_num collision is very unlikely, but just in case draw a new one
+            note.voice_num = np.random.randint(2**32)
+        self.bank.add(note.freq, note.volume, note.phase, note.voice_num)
+
+    def _set_chord(self, notes):
+        for voice_num in list(self.bank.slots.keys()):
+            if voice_num not in notes:
+                self.bank.release(self.bank.slots[voice_num])
+        for voice_num, note in notes.items():
+            slot = self.bank.find_voice(voice_num)
+            if slot is None:
+                self.bank.add(note.freq, note.volume, note.phase, voice_num)
+            else:
+                # notes which stay keep their phase and glide to the new frequency
+                self.bank.set_freq(slot, note.freq)
+                self.bank.volumes[slot] = note.volume
+
+    def _render_segment(self, out):
+        # renders into out (a float32 array), returns False if there is nothing to play
+        if self.bank.size == 0:
+            self.stats.record_idle()
+            return False
+
+        start = time.perf_counter_ns()
+        active_voices = self.bank.size
+        sound = self.bank.render(len(out))
+
+        sound *= self.master_volume
+        peak_level = float(max(sound.max(), -sound.min()))
+        if peak_level > 1 and not self._warned_about_clipping:
+            print("WARNING: sound is clipping - lower the volume")
+            # warn only once
+            self._warned_about_clipping = True
+        # clip the sound to -1..1
+        np.clip(sound, -1, 1, out=out)
 
-        # adjust volume
-        human_amp = self.human_corrected_amplitude(frequency)
-        # human_amp = 1
-        return wave * human_amp
+        render_time = time.perf_counter_ns() - start
+        self.stats.record_render(render_time, len(out) / self.sample_rate, active_voices, peak_level)
+        return True
 
-    def human_corrected_amplitude(self, frequency):
-        low_limit = 300
-        slope = -1.0
-        rescaled = max(frequency / low_limit, 1)
-        return rescaled**slope
+    def render_offline(self, duration, block_duration=1.0):
+        """Apply the sent commands and render the next duration seconds of sound.
+
+        Uses the same code path as live playback, but in long blocks and as fast
+        as possible. Returns mono sound. Only for the "offline" output mode.
+        """
+        self._apply_commands()
+        num_samples = int(round(duration * self.sample_rate))
+        block_size = int(self.sample_rate * block_duration)
+        sound = np.zeros(num_samples, dtype=np.float32)
+        for start in range(0, num_samples, block_size):
+            self._render_segment(sound[start : start + block_size])
+        return sound
+
+    def get_stats(self):
+        """Snapshot of the player's counters, safe to call from any thread."""
+        return self.stats.snapshot(queue_depth=self.commands.qsize())
 
     def kill(self):
         self.alive = False
 
     def add_note(self, freq, volume=1, phase=0):
-        # randomly choose a new voice_num that is not in use
-        voice_nums = [note.voice_num for note in self.notes.copy()]
-        while True:
-            voice_num = np.random.randint(2**32)
-            if voice_num not in voice_nums:
-                break
-        note = Note(freq, volume, phase, voice_num)
-        self.notes_to_add.append(note)
+        voice_num = np.random.randint(2**32)
+        self.commands.put(AddNote(Note(freq, volume, phase, voice_num)))
 
     def remove_note(self, freq_to_delete):
-        for note in self.notes.copy():
-            if note.freq == freq_to_delete:
-                self.notes_to_delete.append(note)
-                break
+        self.commands.put(RemoveNote(freq_to_delete))
 
     def get_chord(self):
-        return [(note.freq, note.volume, note.voice_num) for note in self.notes.copy()]
+        return list(self._chord)
 
     def turn_off_all(self):
-        for note in self.notes.copy():
-            self.notes_to_delete.append(note)
+        self.commands.put(TurnOffAll())
 
     def set_chord(self, chord):
         formatted_chord = dict()
         for freq, volume, voice_num in chord:
             formatted_chord[voice_num] = Note(freq, volume, 0, voice_num)
-        self.chord_to_set = formatted_chord
+        self.commands.put(SetChord(formatted_chord))
 
     def move_note(self, old_freq, new_freq=None, volume_change=None):
-        self.notes_to_move.append((old_freq, new_freq, volume_change))
-
-    def _get_note_by_voice_num(self, voice_num):
-        for note in self.notes.copy():
-            if note.voice_num == voice_num:
-                return note
-        return None
+        self.commands.put(MoveNote(old_freq, new_freq, volume_change))
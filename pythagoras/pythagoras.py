@@ -1,10 +1,9 @@
 import argparse
-import pygame
 
+from chord_search import add_search_arguments
 from config import *
-from dashboard_helpers import *
-
-from polyphonic_player import PolyphonicPlayer
+from polyphonic_player import BIT_RATE, timbres
+from storage import add_storage_argument
 
 
 help_message = """
@@ -24,9 +23,15 @@ scroll on a node to change it's volume
 
 left/right arrows undo/redo chord changes
 
-pressing b toggles binding view
+pressing b toggles binding view, which follows the chord as it changes
 
 pressing h saves the whole history to the current save
+
+pressing F3 toggles an overlay with audio diagnostics
+
+with --viewport, scroll on empty space to zoom and drag with the middle button to pan
+
+with --search, n rings the notes of the next chord found, and ENTER plays it
 """
 
 # ! load command line arguments
@@ -49,6 +54,7 @@ parser.add_argument(
     default=None,
     help="load some set of chords - specify the name of the save in saved_chords.txt file",
 )
+add_storage_argument(parser)
 parser.add_argument(
     "-f",
     "--base-freq",
@@ -63,32 +69,140 @@ parser.add_argument(
     default=600,
     help="draw numbers up to this number",
 )
+parser.add_argument(
+    "--prime-limit",
+    type=int,
+    default=max(primes),
+    help="use all the primes up to this one, for example 7 for a 7-limit lattice",
+)
+parser.add_argument(
+    "--history-limit",
+    type=int,
+    default=10000,
+    help="how many chord changes can be undone, older ones are forgotten",
+)
+parser.add_argument(
+    "--output-mode",
+    type=str,
+    default="blocking",
+    choices=["blocking", "callback"],
+    help="callback mode renders sound ahead into a buffer, which is more robust to stutters",
+)
+parser.add_argument(
+    "--sample-rate",
+    type=int,
+    default=BIT_RATE,
+    help="audio sample rate in Hz",
+)
+parser.add_argument(
+    "--block-size",
+    type=int,
+    default=None,
+    help="number of samples rendered and sent to the sound card at once, "
+    "smaller is lower latency, bigger is less CPU (default: 10 ms worth)",
+)
+parser.add_argument(
+    "--channels",
+    type=int,
+    default=1,
+    help="number of output channels, all of them get the same sound",
+)
+parser.add_argument(
+    "--latency",
+    type=float,
+    default=0.05,
+    help="how many seconds of sound to render ahead in callback mode",
+)
+parser.add_argument(
+    "-t",
+    "--timbre",
+    type=str,
+    default=None,
+    choices=list(timbres.keys()),
+    help="play notes from a wavetable with this timbre, instead of pure sine waves",
+)
+parser.add_argument(
+    "--viewport",
+    action="store_true",
+    help="allow zooming and panning around the lattice, useful with big number limits",
+)
+parser.add_argument(
+    "--search",
+    type=int,
+    default=None,
+    metavar="SIZE",
+    help="look for chords of this many notes, see the --search-* options and chord_search.py",
+)
+add_search_arguments(parser, prefix="search-")
 args = parser.parse_args()
-placement_matrix = placement_matrices[args.placement]
-placement_matrix = placement_matrix[:, : len(primes)]
 
-chords_saver = ChordsSaver()
+# * heavy modules are imported only after parsing, so that --help is instant
+import pygame
+
+from chord_search import ChordSearch, search_chords
+from dashboard_helpers import *
+from lattice import extend_placement, load_smallest_prime_factors, primes_up_to
+from polyphonic_player import PolyphonicPlayer
+
+# the sieve is saved in the data directory, so later runs just load it
+spf = load_smallest_prime_factors(max(args.number_limit, args.prime_limit))
+primes = primes_up_to(args.prime_limit, spf)
+placement_matrix = extend_placement(placement_matrices[args.placement], primes)
+
+chords_saver = ChordsSaver(args.storage)
 if args.load is not None:
     # ! load the saved chords
     saved_chords = chords_saver.get_save(args.load)
 else:
     saved_chords = chords_saver.create_new_save()
-undo_handler = UndoHandler(saved_chords.get("history", []))
+undo_handler = UndoHandler(saved_chords.get("history", []), args.history_limit)
 print()
 
-drawer = Drawer(placement_matrix, args.number_limit)
+drawer = Drawer(placement_matrix, args.number_limit, primes, spf)
 drawer.create_graph()
 drawer.draw_graph()
-player = PolyphonicPlayer(base_freq=args.base_freq)
+player = PolyphonicPlayer(
+    base_freq=args.base_freq,
+    output_mode=args.output_mode,
+    sample_rate=args.sample_rate,
+    block_size=args.block_size,
+    channels=args.channels,
+    latency=args.latency,
+    timbre=args.timbre,
+)
 player.start()
 
+if args.search is not None:
+    # * chords are found one at a time, only when asked for the next one
+    search = ChordSearch(
+        drawer.lattice,
+        args.search,
+        primes=primes,
+        prime_limit=args.search_prime_limit,
+        max_span=args.search_span,
+        interval=args.search_interval,
+        clique=args.search_clique,
+    )
+    candidates = search_chords(search)
+candidate = None
+
 notes_to_change_from = []
 notes_to_change_to = []
 game_over = False
 await_key_to_save_chord = False
 binding_view = False
+binding_view_chord = None
+stats_overlay = False
+last_stats_time = 0
 while not game_over:
     pygame.time.wait(20)
+    # ! keep the binding view in sync with what is playing
+    if binding_view and player.get_chord() != binding_view_chord:
+        binding_view_chord = player.get_chord()
+        drawer.draw_binding_view(binding_view_chord)
+    if stats_overlay and pygame.time.get_ticks() - last_stats_time > 500:
+        drawer.draw_stats_overlay(player.get_stats())
+        last_stats_time = pygame.time.get_ticks()
     for event in pygame.event.get():
         # check exit
         if event.type == pygame.QUIT:
@@ -119,11 +233,38 @@ while not game_over:
                     drawer.draw_graph()
                 else:
                     binding_view = True
-                    drawer.draw_binding_view(player.get_chord())
+                    binding_view_chord = player.get_chord()
+                    drawer.draw_binding_view(binding_view_chord)
+            # ! F3 toggles audio diagnostics
+            elif event.key == pygame.K_F3:
+                stats_overlay = not stats_overlay
+                if not stats_overlay:
+                    # paint over the overlay
+                    if binding_view:
+                        drawer.draw_binding_view(player.get_chord())
+                    else:
+                        drawer.draw_graph()
             # ! h saves the whole history
             elif event.key == pygame.K_h:
                 saved_chords["history"] = undo_handler.get_whole_histroy(player.get_chord())
                 print("history saved")
+            # ! n shows the next chord found by the search
+            elif args.search is not None and event.key == pygame.K_n:
+                candidate = next(candidates, None)
+                if candidate is None:
+                    print("no more chords found")
+                    drawer.highlight_candidates([])
+                else:
+                    print(f"found chord: {list(candidate)}")
+                    drawer.highlight_candidates([candidate])
+                if binding_view:
+                    drawer.draw_binding_view(player.get_chord())
+            # ! enter plays it
+            elif args.search is not None and event.key == pygame.K_RETURN and candidate is not None:
+                undo_handler.save(player.get_chord())
+                chord = [[freq, 1, i] for i, freq in enumerate(candidate)]
+                player.set_chord(chord)
+                drawer.draw_chord(chord)
             # ! space saves chord
             elif event.key == pygame.K_SPACE:
                 await_key_to_save_chord = True
@@ -140,10 +281,21 @@ while not game_over:
                         player.set_chord(chord)
                         drawer.draw_chord(chord)
 
+        # ! drag with the middle button pans the view
+        if event.type == pygame.MOUSEMOTION and args.viewport and event.buttons[1]:
+            drawer.pan_by(event.rel)
+            if not binding_view:
+                drawer.draw_graph()
+
         # ! detect clicks
         if event.type == pygame.MOUSEBUTTONDOWN:
             clicked_node = drawer.get_clicked_node(event.pos)
             if clicked_node is None:
+                # ! scrolling on empty space zooms
+                if args.viewport and event.button in [4, 5]:
+                    drawer.zoom_at(event.pos, 1 if event.button == 4 else -1)
+                    if not binding_view:
+                        drawer.draw_graph()
                 continue
 
             # clicked a circle - now check if it was already clicked
@@ -164,9 +316,9 @@ while not game_over:
                     if clicked_node not in notes_to_change_to:
                         notes_to_change_to.append(clicked_node)
                     if len(notes_to_change_from) == len(notes_to_change_to):
-                        # ! switch all
+                        # ! switch all, as one undo step
+                        undo_handler.save(player.get_chord())
                         for freq1, freq2 in zip(notes_to_change_from, notes_to_change_to):
-                            undo_handler.save(player.get_chord())
                             drawer.deactivate_node(freq1)
                             drawer.activate_node(freq2)
                             player.move_note(freq1, new_freq=freq2)
@@ -181,10 +333,13 @@ while not game_over:
             elif event.button == 5:
                 player.move_note(clicked_node, volume_change=1 / 1.1)
 
-            pygame.display.update()
+            drawer.update_display()
 
 player.kill()
 player.join()
+stats = player.get_stats()
+if stats["underruns"] or stats["stream_underflows"]:
+    print(f"audio underruns: {stats['underruns']}, stream underflows: {stats['stream_underflows']}")
 pygame.quit()
 chords_saver.save_all_saves()
 print(f"save name: {chords_saver.last_loaded_save_name}")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+import argparse
+import fnmatch
+import multiprocessing
+import os
+import time
+import wave
+
+import numpy as np
+
+from storage import ChordsSaver, add_storage_argument
+from polyphonic_player import BIT_RATE, PolyphonicPlayer, timbres
+
+
+def get_chord_sequence(save, what="all"):
+    """Chords of a save in the order they are rendered.
+
+    what is "chords" (the chords saved under keys), "history" or "all" (both).
+    """
+    chords = []
+    if what in ["chords", "all"]:
+        chords += [chord for keyname, chord in save.items() if keyname != "history"]
+    if what in ["history", "all"]:
+        chords += save.get("history", [])
+    return chords
+
+
+class AudioWriter:
+    """Writes float32 sound either to a 16 bit WAV or to a raw float32 file."""
+
+    def __init__(self, path, sample_rate=BIT_RATE):
+        self.is_wav = path.endswith(".wav")
+        if self.is_wav:
+            self.file = wave.open(path, "wb")
+            self.file.setnchannels(1)
+            self.file.setsampwidth(2)
+            self.file.setframerate(sample_rate)
+        else:
+            self.file = open(path, "wb")
+
+    def write(self, sound):
+        if self.is_wav:
+            self.file.writeframes((sound * 32767).astype("<i2").tobytes())
+        else:
+            self.file.write(sound.astype("<f4").tobytes())
+
+    def close(self):
+        self.file.close()
+
+
+def render_save(
+    save,
+    path,
+    base_freq=10,
+    chord_duration=1.0,
+    what="all",
+    timbre=None,
+    sample_rate=BIT_RATE,
+):
+    """Render the chords of a save to a file, one after another.
+
+    Returns the number of seconds of sound rendered.
+    """
+    player = PolyphonicPlayer(
+        base_freq=base_freq, output_mode="offline", sample_rate=sample_rate, timbre=timbre
+    )
+    writer = AudioWriter(path, sample_rate)
+    chords = get_chord_sequence(save, what)
+    for chord in chords:
+        player.set_chord(chord)
+        writer.write(player.render_offline(chord_duration))
+    writer.close()
+    return len(chords) * chord_duration
+
+
+def _render_job(job):
+    save_name, save, path, options = job
+    seconds = render_save(save, path, **options)
+    return save_name, seconds, os.path.getsize(path)
+
+
+def render_library(saves, output_dir, jobs=None, extension="wav", **options):
+    """Render many saves in parallel, each to its own file in output_dir.
+
+    saves maps save names to saves. Files are written by the worker processes
+    as soon as each save is rendered. Yields (save_name, seconds, num_bytes)
+    in the order the saves get finished.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    job_list = [
+        (save_name, save, os.path.join(output_dir, f"{save_name}.{extension}"), options)
+        for save_name, save in saves.items()
+    ]
+    with multiprocessing.Pool(jobs) as pool:
+        yield from pool.imap_unordered(_render_job, job_list)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Render saved chords to an audio file, without any audio device",
+    )
+    parser.add_argument(
+        "save_name",
+        type=str,
+        nargs="?",
+        default=None,
+        help="name of the save in saved_chords.txt file",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="output file, .wav for a 16 bit WAV, anything else for raw float32 (default: SAVE_NAME.wav)",
+    )
+    parser.add_argument(
+        "-a",
+        "--all",
+        action="store_true",
+        help="render every save in saved_chords.txt file, in parallel",
+    )
+    parser.add_argument(
+        "-m",
+        "--match",
+        type=str,
+        default=None,
+        help="render every save with a name matching this shell-style pattern, in parallel",
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="renders",
+        help="where to put the files when rendering many saves",
+    )
+    parser.add_argument(
+        "--raw",
+        action="store_true",
+        help="when rendering many saves, write raw float32 files instead of WAVs",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=None,
+        help="number of worker processes when rendering many saves (default: number of CPUs)",
+    )
+    add_storage_argument(parser)
+    parser.add_argument(
+        "-f",
+        "--base-freq",
+        type=int,
+        default=10,
+        help="all numbers will be multiplied by this number to get frequencies in Hz",
+    )
+    parser.add_argument(
+        "-d",
+        "--chord-duration",
+        type=float,
+        default=1.0,
+        help="how many seconds each chord is played",
+    )
+    parser.add_argument(
+        "-w",
+        "--what",
+        type=str,
+        default="all",
+        choices=["chords", "history", "all"],
+        help="render the chords saved under keys, the history, or both",
+    )
+    parser.add_argument(
+        "-t",
+        "--timbre",
+        type=str,
+        default=None,
+        choices=list(timbres.keys()),
+        help="play notes from a wavetable with this timbre, instead of pure sine waves",
+    )
+    parser.add_argument(
+        "--sample-rate",
+        type=int,
+        default=BIT_RATE,
+        help="sample rate of the rendered files in Hz",
+    )
+    args = parser.parse_args()
+    options = dict(
+        base_freq=args.base_freq,
+        chord_duration=args.chord_duration,
+        what=args.what,
+        timbre=args.timbre,
+        sample_rate=args.sample_rate,
+    )
+
+    if args.all or args.match is not None:
+        # ! render many saves
+        chords_saver = ChordsSaver(args.storage)
+        pattern = args.match if args.match is not None else "*"
+        # only the matching saves are loaded
+        save_names = [name for name in chords_saver.names() if fnmatch.fnmatch(name, pattern)]
+        saves = {name: dict(chords_saver.load(name)) for name in save_names}
+        print(f"rendering {len(saves)} saves to {os.path.abspath(args.output_dir)}")
+
+        start_time = time.time()
+        total_seconds = 0
+        total_bytes = 0
+        results = render_library(
+            saves, args.output_dir, jobs=args.jobs, extension="f32" if args.raw else "wav", **options
+        )
+        for i, (save_name, seconds, num_bytes) in enumerate(results):
+            total_seconds += seconds
+            total_bytes += num_bytes
+            print(f"[{i + 1}/{len(saves)}] {save_name}: {seconds:.1f}s")
+        elapsed = time.time() - start_time
+
+        print(f"\nrendered {len(saves)} saves, {total_seconds:.1f}s of sound, {total_bytes / 2**20:.1f} MiB")
+        print(f"took {elapsed:.2f}s: {len(saves) / elapsed:.1f} saves/s, {total_seconds / elapsed:.0f}x realtime")
+        exit(0)
+
+    if args.save_name is None:
+        parser.error("give a save name, or use --all or --match")
+
+    # ! render a single save
+    save = ChordsSaver(args.storage).get_save(args.save_name)
+    output = args.output if args.output is not None else f"{args.save_name}.wav"
+
+    start_time = time.time()
+    seconds = render_save(save, output, **options)
+    elapsed = time.time() - start_time
+    speedup = seconds / elapsed if elapsed > 0 else np.inf
+    print(f"\nrendered {seconds:.1f}s of sound to {os.path.abspath(output)} ({speedup:.0f}x realtime)")
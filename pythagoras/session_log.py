@@ -0,0 +1,137 @@
+import csv
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+kinds = ["auto", "node", "edge"]
+# one row of the binary log - the ratios in the 10 slots are numbers from 0 to 99
+# ! rows are stored one after another, not column by column: fixed size rows can
+# ! be appended as they come and memory-mapped as one array, which analytics.py
+# ! splits into row ranges for its processes
+binary_dtype = np.dtype([("time", "<f8"), ("kind", "u1"), ("ratios", "u1", 10)])
+
+
+def load_binary_log(path):
+    """Rows of a binary session log, memory-mapped, as a structured array with binary_dtype."""
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=binary_dtype)
+    return np.memmap(path, dtype=binary_dtype, mode="r")
+
+
+class SessionLogger:
+    """Logs the chords played in a session, writing them in a background thread.
+
+    log only puts the row on a bounded queue, so it never waits for the disk.
+    If the disk can't keep up and the queue fills, rows are dropped and counted
+    in dropped. The thread writes rows in batches and fsyncs at most every
+    fsync_interval seconds. When the file gets bigger than max_bytes, it's
+    rotated like in logging.handlers.RotatingFileHandler: path -> path.1 ->
+    path.2 and so on, keeping backup_count old files.
+
+    format is "csv", with [time, kind] + ratios rows, or "binary", with rows
+    of binary_dtype - 19 bytes each. The binary log is row by row, not
+    columnar, but load_binary_log still gives each column as a (strided)
+    array, e.g. rows["ratios"].
+    """
+
+    def __init__(
+        self,
+        path,
+        format="csv",
+        queue_size=10000,
+        batch_size=256,
+        fsync_interval=5.0,
+        max_bytes=None,
+        backup_count=5,
+    ):
+        self.path = path
+        self.format = format
+        self.batch_size = batch_size
+        self.fsync_interval = fsync_interval
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.dropped = 0
+
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._file = self._open()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def log(self, kind, ratios):
+        try:
+            self._queue.put_nowait((time.time(), kind, list(ratios)))
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self):
+        # None tells the thread to write what's left and stop
+        self._queue.put(None)
+        self._thread.join()
+
+    def _open(self):
+        if self.format == "csv":
+            return open(self.path, "a", newline="")
+        return open(self.path, "ab")
+
+    def _write(self, rows):
+        if self.format == "csv":
+            csv.writer(self._file).writerows([[t, kind] + ratios for t, kind, ratios in rows])
+        else:
+            batch = np.zeros(len(rows), dtype=binary_dtype)
+            batch["time"] = [t for t, _, _ in rows]
+            batch["kind"] = [kinds.index(kind) for _, kind, _ in rows]
+            batch["ratios"] = [ratios for _, _, ratios in rows]
+            self._file.write(batch.tobytes())
+        self._file.flush()
+        self._unsynced = True
+
+    def _sync(self):
+        os.fsync(self._file.fileno())
+        self._last_sync = time.monotonic()
+        self._unsynced = False
+
+    def _rotate(self):
+        self._sync()
+        self._file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backup_count > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._file = self._open()
+
+    def _run(self):
+        self._last_sync = time.monotonic()
+        self._unsynced = False
+        stopping = False
+        while not stopping:
+            try:
+                row = self._queue.get(timeout=self.fsync_interval)
+            except queue.Empty:
+                if self._unsynced:
+                    self._sync()
+                continue
+            # * take whatever else is waiting, to write it at once
+            rows = []
+            while row is not None:
+                rows.append(row)
+                if len(rows) == self.batch_size:
+                    break
+                try:
+                    row = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = row is None
+
+            if rows:
+                self._write(rows)
+            if self.max_bytes is not None and self._file.tell() > self.max_bytes:
+                self._rotate()
+            elif self._unsynced and (stopping or time.monotonic() - self._last_sync > self.fsync_interval):
+                self._sync()
+        self._file.close()
@@ -0,0 +1,540 @@
+import os
+import json
+import time
+import pathlib
+import sqlite3
+import hashlib
+import itertools
+import threading
+from fractions import Fraction
+
+import numpy as np
+
+data_dir = pathlib.Path(__file__).parent.parent / "data"
+
+
+class JsonLinesBackend:
+    """The saved_chords.txt file - read whole at the start, and written whole at the end."""
+
+    def __init__(self, path=data_dir / "saved_chords.txt"):
+        self.path = path
+        self.saves = dict()
+        if os.path.isfile(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    save_name, save_dict = json.loads(line).popitem()
+                    self.saves[save_name] = save_dict
+
+    def __contains__(self, save_name):
+        return save_name in self.saves
+
+    def names(self):
+        return list(self.saves.keys())
+
+    def load(self, save_name):
+        return self.saves.get(save_name)
+
+    def update(self, save_name, keyname, value):
+        self.saves.setdefault(save_name, dict())[keyname] = value
+
+    def close(self):
+        with open(self.path, "w") as f:
+            for save_name, save in self.saves.items():
+                if save:
+                    f.write(json.dumps({save_name: save}) + "\n")
+
+
+class LogBackend:
+    """Saves in an append-only log of JSON records, with a memory-mapped hash index of where each save is."""
+
+    # index header: covered log length, number of saves, number of records
+    header_size = 3
+    initial_capacity = 1024
+
+    def __init__(self, path=data_dir / "saved_chords.log", import_from=data_dir / "saved_chords.txt"):
+        self.path = str(path)
+        self.index_path = self.path + ".index"
+        self.lock = threading.RLock()
+        self.compaction = None
+
+        is_new = not os.path.isfile(self.path)
+        self.log = open(self.path, "a+b")
+        self._open_index()
+        if is_new and import_from is not None and os.path.isfile(import_from):
+            # * one time migration from the JSON lines file
+            for save_name, save in JsonLinesBackend(import_from).saves.items():
+                if save:
+                    self._append(dict(name=save_name, save=save))
+
+        _, num_saves, num_records = self.index[: self.header_size]
+        if num_records > 2 * num_saves + 100:
+            self.compaction = threading.Thread(target=self.compact, daemon=True)
+            self.compaction.start()
+
+    # ! index
+
+    def _open_index(self):
+        log_length = os.path.getsize(self.path)
+        if os.path.isfile(self.index_path):
+            self.index = np.memmap(self.index_path, dtype=np.uint64, mode="r+")
+        if not os.path.isfile(self.index_path) or int(self.index[0]) > log_length:
+            # no index, or it doesn't belong to this log - build it again
+            self._write_index(self._empty_index(self.initial_capacity))
+        covered_length = int(self.index[0])
+        # index the records which were appended but didn't get into the index
+        # (read with another file object, because finding slots reads self.log)
+        offset = covered_length
+        with open(self.path, "rb") as f:
+            f.seek(covered_length)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # cut off in the middle of writing
+                    self.log.truncate(offset)
+                    break
+                self._set_head(json.loads(line)["name"], offset)
+                offset += len(line)
+        self.index[0] = offset
+
+    def _empty_index(self, capacity):
+        return np.zeros(self.header_size + 2 * capacity, dtype=np.uint64)
+
+    def _close_index(self):
+        # ! a file can't be replaced or removed on Windows while it's mapped,
+        # ! so the map has to be dropped first (with all the views of it)
+        if getattr(self, "index", None) is not None:
+            self.index.flush()
+            self.index = None
+
+    def _write_index(self, index):
+        # write to a temporary file first, so that a crash never leaves a half written index
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        index.tofile(temp_path)
+        self._close_index()
+        os.replace(temp_path, self.index_path)
+        self.index = np.memmap(self.index_path, dtype=np.uint64, mode="r+")
+
+    def _slots(self, index=None):
+        # (hash, offset + 1) pairs, offset + 1 == 0 marks an empty slot
+        index = self.index if index is None else index
+        return index[self.header_size :].reshape(-1, 2)
+
+    @staticmethod
+    def _hash(save_name):
+        return int.from_bytes(hashlib.blake2b(save_name.encode(), digest_size=8).digest(), "little")
+
+    def _find_slot(self, slots, name_hash, save_name=None):
+        # the slot of save_name, or the empty slot where it would go
+        # without save_name, just the first empty slot for this hash
+        mask = len(slots) - 1
+        i = name_hash & mask
+        while slots[i, 1] != 0:
+            # ! different names can have the same hash, so the name is checked
+            # ! in the last record of the save, which the slot points to
+            if save_name is not None and int(slots[i, 0]) == name_hash:
+                if self._read_record(self.log, int(slots[i, 1]) - 1)["name"] == save_name:
+                    break
+            i = (i + 1) & mask
+        return i
+
+    def _get_head(self, save_name):
+        slots = self._slots()
+        i = self._find_slot(slots, self._hash(save_name), save_name)
+        if slots[i, 1] == 0:
+            return None
+        return int(slots[i, 1]) - 1
+
+    def _set_head(self, save_name, offset):
+        slots = self._slots()
+        name_hash = self._hash(save_name)
+        i = self._find_slot(slots, name_hash, save_name)
+        if slots[i, 1] == 0:
+            slots[i, 0] = name_hash
+            self.index[1] += 1
+        slots[i, 1] = offset + 1
+        self.index[2] += 1
+        # keep the table at most half full, so that probing stays short
+        is_full = self.index[1] * 2 > len(slots)
+        del slots
+        if is_full:
+            self._grow_index()
+
+    def _grow_index(self):
+        old_slots = np.array(self._slots())
+        index = self._empty_index(len(old_slots) * 2)
+        index[: self.header_size] = self.index[: self.header_size]
+        slots = self._slots(index)
+        # the saves are all different, so they only need empty slots
+        for name_hash, offset in old_slots[old_slots[:, 1] != 0].tolist():
+            slots[self._find_slot(slots, name_hash)] = (name_hash, offset)
+        self._write_index(index)
+
+    # ! log
+
+    def _append(self, record):
+        prev = self._get_head(record["name"])
+        record["prev"] = -1 if prev is None else prev
+        line = (json.dumps(record) + "\n").encode()
+        self.log.seek(0, os.SEEK_END)
+        offset = self.log.tell()
+        self.log.write(line)
+        self.log.flush()
+        self._set_head(record["name"], offset)
+        self.index[0] = offset + len(line)
+
+    def _read_record(self, f, offset):
+        f.seek(offset)
+        return json.loads(f.readline())
+
+    def _read_save(self, f, offset):
+        records = []
+        while offset != -1:
+            record = self._read_record(f, offset)
+            records.append(record)
+            if "save" in record:
+                break
+            offset = record["prev"]
+        # replay the records from the oldest
+        save = dict()
+        for record in reversed(records):
+            if "save" in record:
+                save.update(record["save"])
+            else:
+                save[record["key"]] = record["value"]
+        return save
+
+    # ! interface of the backends
+
+    def __contains__(self, save_name):
+        with self.lock:
+            return self._get_head(save_name) is not None
+
+    def names(self):
+        with self.lock:
+            slots = self._slots()
+            offsets = slots[slots[:, 1] != 0, 1] - 1
+            return [self._read_record(self.log, int(offset))["name"] for offset in np.sort(offsets)]
+
+    def load(self, save_name):
+        with self.lock:
+            head = self._get_head(save_name)
+            if head is None:
+                return None
+            return self._read_save(self.log, head)
+
+    def update(self, save_name, keyname, value):
+        with self.lock:
+            self._append(dict(name=save_name, key=keyname, value=value))
+
+    def close(self):
+        if self.compaction is not None:
+            self.compaction.join()
+        with self.lock:
+            self._close_index()
+            self.log.close()
+
+    # ! compaction
+
+    def compact(self):
+        """Rewrite the log with one record per save, while it keeps being used."""
+        compact_path = self.path + ".compact"
+        with self.lock:
+            end = int(self.index[0])
+            slots = np.array(self._slots())
+        heads = np.sort(slots[slots[:, 1] != 0, 1] - 1)
+
+        # * records before end never change, so they're read without the lock
+        new_heads = dict()
+        with open(self.path, "rb") as old_log, open(compact_path, "wb") as new_log:
+            for head in heads.tolist():
+                save_name = self._read_record(old_log, head)["name"]
+                record = dict(name=save_name, save=self._read_save(old_log, head), prev=-1)
+                new_heads[save_name] = new_log.tell()
+                new_log.write((json.dumps(record) + "\n").encode())
+
+        with self.lock:
+            # records appended in the meantime go to the end of the new log
+            with open(compact_path, "ab") as new_log:
+                self.log.seek(end)
+                for line in self.log:
+                    record = json.loads(line)
+                    record["prev"] = new_heads.get(record["name"], -1)
+                    new_heads[record["name"]] = new_log.tell()
+                    new_log.write((json.dumps(record) + "\n").encode())
+
+            # without the index, a crash at any point leaves a log which gets indexed again
+            self.log.close()
+            self._close_index()
+            os.remove(self.index_path)
+            os.replace(compact_path, self.path)
+            self.log = open(self.path, "a+b")
+            self._write_index(self._empty_index(self.initial_capacity))
+            for save_name, offset in new_heads.items():
+                self._set_head(save_name, offset)
+            self.index[0] = os.path.getsize(self.path)
+
+
+class SqliteBackend:
+    """Saves in an SQLite database, with chords and notes in their own tables.
+
+    Each chord is a row of chords - either saved under a key, or a step of the
+    history. Its notes are rows of notes, and the reduced ratios between every
+    two of its notes are rows of intervals, so questions like "which chords
+    contain 7:4" are answered by the indexes, without loading any saves.
+    Each update is its own transaction, so nothing is lost on a crash.
+    """
+
+    schema = """
+        CREATE TABLE IF NOT EXISTS saves (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            created REAL NOT NULL,
+            modified REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS chords (
+            id INTEGER PRIMARY KEY,
+            save_id INTEGER NOT NULL REFERENCES saves(id) ON DELETE CASCADE,
+            keyname TEXT NOT NULL,
+            -- position in the history, NULL for chords saved under a key
+            step INTEGER,
+            -- sorted frequencies, like "4,5,6"
+            freq_set TEXT NOT NULL,
+            max_freq REAL,
+            created REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS notes (
+            chord_id INTEGER NOT NULL REFERENCES chords(id) ON DELETE CASCADE,
+            position INTEGER NOT NULL,
+            freq REAL NOT NULL,
+            volume REAL NOT NULL,
+            voice_num INTEGER NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS intervals (
+            chord_id INTEGER NOT NULL REFERENCES chords(id) ON DELETE CASCADE,
+            numerator INTEGER NOT NULL,
+            denominator INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS saves_modified ON saves(modified);
+        CREATE INDEX IF NOT EXISTS chords_save ON chords(save_id, keyname, step);
+        CREATE INDEX IF NOT EXISTS chords_freq_set ON chords(freq_set);
+        CREATE INDEX IF NOT EXISTS chords_created ON chords(created);
+        CREATE INDEX IF NOT EXISTS notes_chord ON notes(chord_id, position);
+        CREATE INDEX IF NOT EXISTS notes_freq ON notes(freq);
+        CREATE INDEX IF NOT EXISTS intervals_ratio ON intervals(numerator, denominator);
+    """
+
+    def __init__(self, path=data_dir / "saved_chords.sqlite"):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA foreign_keys = ON")
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(self.schema)
+
+    @staticmethod
+    def freq_set(freqs):
+        return ",".join(str(_as_number(freq)) for freq in sorted(freqs))
+
+    def _write_chord(self, save_id, keyname, step, chord, now):
+        freqs = [freq for freq, _, _ in chord]
+        cursor = self.db.execute(
+            "INSERT INTO chords (save_id, keyname, step, freq_set, max_freq, created) VALUES (?, ?, ?, ?, ?, ?)",
+            (save_id, keyname, step, self.freq_set(freqs), max(freqs, default=None), now),
+        )
+        chord_id = cursor.lastrowid
+        self.db.executemany(
+            "INSERT INTO notes (chord_id, position, freq, volume, voice_num) VALUES (?, ?, ?, ?, ?)",
+            [(chord_id, i, freq, volume, voice_num) for i, (freq, volume, voice_num) in enumerate(chord)],
+        )
+        intervals = set()
+        for low, high in itertools.combinations(sorted(set(freqs)), 2):
+            ratio = Fraction(high) / Fraction(low)
+            intervals.add((ratio.numerator, ratio.denominator))
+        self.db.executemany(
+            "INSERT INTO intervals (chord_id, numerator, denominator) VALUES (?, ?, ?)",
+            [(chord_id, numerator, denominator) for numerator, denominator in intervals],
+        )
+
+    def _write(self, save_name, keyname, value, now):
+        self.db.execute(
+            "INSERT INTO saves (name, created, modified) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET modified = excluded.modified",
+            (save_name, now, now),
+        )
+        (save_id,) = self.db.execute("SELECT id FROM saves WHERE name = ?", (save_name,)).fetchone()
+        self.db.execute("DELETE FROM chords WHERE save_id = ? AND keyname = ?", (save_id, keyname))
+        if keyname == "history":
+            for step, chord in enumerate(value):
+                self._write_chord(save_id, keyname, step, chord, now)
+        else:
+            self._write_chord(save_id, keyname, None, value, now)
+
+    def import_json_lines(self, path=data_dir / "saved_chords.txt"):
+        """Copy all the saves from a saved_chords.txt file, in one transaction.
+
+        Returns the number of saves imported.
+        """
+        saves = JsonLinesBackend(path).saves
+        now = time.time()
+        with self.db:
+            for save_name, save in saves.items():
+                for keyname, value in save.items():
+                    self._write(save_name, keyname, value, now)
+        return len(saves)
+
+    # ! interface of the backends
+
+    def __contains__(self, save_name):
+        return self.db.execute("SELECT 1 FROM saves WHERE name = ?", (save_name,)).fetchone() is not None
+
+    def names(self):
+        return [name for (name,) in self.db.execute("SELECT name FROM saves ORDER BY id")]
+
+    def load(self, save_name):
+        rows = self.db.execute(
+            "SELECT c.keyname, c.step, n.freq, n.volume, n.voice_num "
+            "FROM saves s JOIN chords c ON c.save_id = s.id LEFT JOIN notes n ON n.chord_id = c.id "
+            "WHERE s.name = ? ORDER BY c.id, n.position",
+            (save_name,),
+        ).fetchall()
+        if not rows and save_name not in self:
+            return None
+        save = dict()
+        chords = dict()
+        for keyname, step, freq, volume, voice_num in rows:
+            if (keyname, step) not in chords:
+                chords[(keyname, step)] = []
+                if step is None:
+                    save[keyname] = chords[(keyname, step)]
+                else:
+                    save.setdefault(keyname, []).append(chords[(keyname, step)])
+            if freq is not None:
+                chords[(keyname, step)].append([_as_number(freq), volume, voice_num])
+        return save
+
+    def update(self, save_name, keyname, value):
+        with self.db:
+            self._write(save_name, keyname, value, time.time())
+
+    def close(self):
+        self.db.close()
+
+    # ! queries
+
+    def _found_chords(self, where, params):
+        rows = self.db.execute(
+            "SELECT s.name, c.keyname, c.step, c.freq_set FROM chords c JOIN saves s ON s.id = c.save_id "
+            f"WHERE {where} ORDER BY c.id",
+            params,
+        )
+        return [
+            (save_name, keyname, step, [_as_number(float(freq)) for freq in freq_set.split(",") if freq])
+            for save_name, keyname, step, freq_set in rows
+        ]
+
+    def chords_with_ratio(self, numerator, denominator):
+        """Chords with two notes in this ratio, as (save name, key, history step, frequencies)."""
+        ratio = Fraction(numerator, denominator)
+        return self._found_chords(
+            "c.id IN (SELECT chord_id FROM intervals WHERE numerator = ? AND denominator = ?)",
+            (ratio.numerator, ratio.denominator),
+        )
+
+    def chords_with_notes(self, freqs):
+        """Chords made of exactly these frequencies, as (save name, key, history step, frequencies)."""
+        return self._found_chords("c.freq_set = ?", (self.freq_set(freqs),))
+
+    def saves_with_notes_up_to(self, max_freq):
+        """Names of the saves which don't use any note higher than max_freq."""
+        rows = self.db.execute(
+            "SELECT s.name FROM saves s JOIN chords c ON c.save_id = s.id "
+            "GROUP BY s.id HAVING MAX(c.max_freq) <= ? ORDER BY s.id",
+            (max_freq,),
+        )
+        return [name for (name,) in rows]
+
+
+def _as_number(freq):
+    # frequencies come back from the database as floats
+    return int(freq) if freq == int(freq) else freq
+
+
+backends = dict(jsonl=JsonLinesBackend, log=LogBackend, sqlite=SqliteBackend)
+
+
+def add_storage_argument(parser):
+    """The --storage option, shared by all the scripts which use the saves."""
+    parser.add_argument(
+        "--storage",
+        type=str,
+        default="jsonl",
+        choices=list(backends),
+        help="jsonl keeps saves in saved_chords.txt, rewritten on exit; log appends every change "
+        "to saved_chords.log as it happens (the first run imports saved_chords.txt), "
+        "sqlite keeps them in saved_chords.sqlite, see library.py",
+    )
+
+
+class TrackedSave(dict):
+    """A save which passes every change of its chords to the storage backend."""
+
+    def __init__(self, save_name, save, backend):
+        super().__init__(save)
+        self.save_name = save_name
+        self.backend = backend
+
+    def __setitem__(self, keyname, value):
+        super().__setitem__(keyname, value)
+        self.backend.update(self.save_name, keyname, value)
+
+
+class ChordsSaver:
+    def __init__(self, storage="jsonl"):
+        self.backend = backends[storage]()
+
+    @property
+    def all_saves(self):
+        return {save_name: self.load(save_name) for save_name in self.names()}
+
+    def names(self):
+        return self.backend.names()
+
+    def load(self, save_name):
+        save = self.backend.load(save_name)
+        if save is None:
+            return None
+        return TrackedSave(save_name, save, self.backend)
+
+    def get_save(self, save_name):
+        save = self.load(save_name)
+        if save is None:
+            print("Error: there is no save with this name")
+            exit(1)
+
+        print("\nloaded chords:")
+        for keyname, chord in save.items():
+            if keyname == "history":
+                history = chord
+                continue
+            print(f"{keyname}: {[freq for freq, _, _ in chord]}")
+        if "history" in save:
+            print("\nhistory:")
+            for chord in history:
+                print(f"{[freq for freq, _, _ in chord]}")
+        self.last_loaded_save_name = save_name
+
+        # * note that save is a dict so it is passes by reference and will be modified
+        return save
+
+    def save_all_saves(self):
+        self.backend.close()
+        print("\nchords saved")
+
+    def create_new_save(self):
+        # imported here, so that only creating a save needs it
+        import randomname
+
+        # make sure the name is unique
+        while True:
+            save_name = randomname.get_name()
+            if save_name not in self.backend:
+                break
+        self.last_loaded_save_name = save_name
+        return TrackedSave(save_name, dict(), self.backend)
@@ -0,0 +1,65 @@
+# tests for the session log analytics
+import itertools
+import time
+import types
+
+import numpy as np
+
+import session_log
+from analytics import *
+from session_log import SessionLogger
+
+
+def make_log(path, format, monkeypatch, num_rows=500):
+    rng = np.random.default_rng(0)
+    rows = []
+    for i in range(num_rows):
+        ratios = rng.integers(0, 100, size=10) * (rng.random(10) < 0.4)
+        rows.append((1712345678.25 + i * 0.5, kinds[rng.integers(0, 3)], ratios.tolist()))
+    # the rows are logged half a second apart
+    clock = iter([t for t, _, _ in rows])
+    fake_time = types.SimpleNamespace(time=lambda: next(clock), monotonic=time.monotonic)
+    monkeypatch.setattr(session_log, "time", fake_time)
+    logger = SessionLogger(path, format=format)
+    for _, kind, ratios in rows:
+        logger.log(kind, ratios)
+    logger.close()
+    assert logger.dropped == 0
+    return rows
+
+
+def test_analytics_matches_simple_counting(tmp_path, monkeypatch):
+    for format, filename in [("csv", "ratios.csv"), ("binary", "ratios.bin")]:
+        path = str(tmp_path / filename)
+        rows = make_log(path, format, monkeypatch)
+        # tiny chunks and many processes, to have many borders between parts
+        stats = analyze_log(path, jobs=3, chunk_bytes=1000)
+
+        assert stats.num_rows == len(rows)
+        expected_counts = np.zeros(100, dtype=int)
+        expected_pairs = np.zeros((100, 100), dtype=int)
+        for _, _, ratios in rows:
+            for n in ratios:
+                expected_counts[n] += 1
+            notes = sorted(set(ratios) - {0})
+            for a, b in itertools.product(notes, notes):
+                expected_pairs[a, b] += 1
+        expected_counts[0] = 0
+        assert stats.ratio_counts.tolist() == expected_counts.tolist()
+        assert (stats.cooccurrence == expected_pairs).all()
+
+        row_kinds = [kinds.index(kind) for _, kind, _ in rows]
+        assert stats.kind_transitions.sum() == len(rows) - 1
+        assert stats.kind_transitions[row_kinds[0], row_kinds[1]] >= 1
+        recorded = [(t, set(ratios) - {0}) for t, kind, ratios in rows if kind != "auto"]
+        changed = [len(a ^ b) for (_, a), (_, b) in zip(recorded[:-1], recorded[1:])]
+        assert stats.changed_notes.tolist() == np.bincount(changed, minlength=21).tolist()
+        assert np.isclose(stats.recorded_gaps, recorded[-1][0] - recorded[0][0])
+
+
+def test_ranking_breaks_ties_by_number():
+    counts = np.array([0, 3, 5, 3, 0, 5, 1])
+    assert ranking(counts).tolist() == [2, 5, 1, 3, 6]
+    pairs = np.array([[0, 2, 2], [0, 0, 4], [0, 0, 0]])
+    order = np.unravel_index(ranking(pairs), pairs.shape)
+    assert list(zip(*map(np.ndarray.tolist, order))) == [(1, 2), (0, 1), (0, 2)]
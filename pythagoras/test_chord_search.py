@@ -0,0 +1,53 @@
+# tests for the chord search
+import itertools
+
+from chord_search import *
+
+
+def brute_force(lattice, size, max_span, allowed, interval, clique):
+    edges = set(map(tuple, lattice.edge_nodes.tolist()))
+    edges |= {(v, u) for u, v in edges}
+    found = set()
+    for nodes in itertools.combinations([i for i in range(len(lattice)) if allowed(i)], size):
+        chord = [int(lattice.numbers[i]) for i in nodes]
+        if max_span is not None and chord[-1] > chord[0] * max_span:
+            continue
+        if interval is not None and not any(n * interval[0] == m * interval[1] for n in chord for m in chord):
+            continue
+        if clique:
+            if not all((u, v) in edges for u, v in itertools.combinations(nodes, 2)):
+                continue
+        else:
+            reached = {nodes[0]}
+            for _ in range(size):
+                reached |= {v for u in reached for v in nodes if (u, v) in edges}
+            if len(reached) < size:
+                continue
+        found.add(tuple(chord))
+    return found
+
+
+def test_search_matches_brute_force():
+    primes = [2, 3, 5, 7]
+    ratios = [(a, b) for a, b, _, _ in draw_lines_for_ratios]
+    lattice = build_lattice(60, primes, ratios)
+    cases = [
+        dict(size=3),
+        dict(size=4, max_span=3, clique=True),
+        dict(size=3, prime_limit=5, interval=(4, 5)),
+    ]
+    for case in cases:
+        search = ChordSearch(lattice, primes=primes, **case)
+        found = list(search_chords(search))
+        assert len(found) == len(set(found))
+        no_7 = lambda i: lattice.exponents[i, 3] == 0
+        expected = brute_force(
+            lattice,
+            case["size"],
+            case.get("max_span"),
+            no_7 if case.get("prime_limit") == 5 else lambda i: True,
+            case.get("interval"),
+            case.get("clique", False),
+        )
+        assert set(found) == expected and expected
+    assert set(search_chords(search, jobs=2)) == expected
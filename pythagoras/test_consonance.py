@@ -0,0 +1,36 @@
+# tests for the chord scoring
+import itertools
+
+import numpy as np
+
+from consonance import *
+
+
+def brute_force_roughness(chord, base_freq=10, partials=default_partials):
+    spectrum = [(base_freq * n * k, a) for n in chord for k, a in enumerate(partials, start=1)]
+    roughness = 0
+    for (f1, a1), (f2, a2) in itertools.combinations(spectrum, 2):
+        s = 0.24 / (0.0207 * min(f1, f2) + 18.96)
+        roughness += min(a1, a2) * (np.exp(-3.51 * s * abs(f2 - f1)) - np.exp(-5.75 * s * abs(f2 - f1)))
+    return roughness
+
+
+def test_scores():
+    chords = [[20, 40], [20, 30], [15, 16], [4, 5, 6], [7], [9, 1500, 3001]]
+    scores = score_chords(chords)
+    expected = [brute_force_roughness(chord) for chord in chords]
+    assert np.allclose(scores["roughness"], expected)
+    # an octave, a fifth and a semitone get less and less consonant
+    for name in ["roughness", "entropy", "tenney"]:
+        assert scores[name][0] < scores[name][1] < scores[name][2]
+    assert np.isclose(scores["tenney"][3], np.log2(4 * 5 * 6))
+    assert scores["entropy"][4] == 0 and scores["tenney"][4] == 0
+    # a doubled note changes no score, also above the roughness table
+    doubled = score_chords([[4, 5, 5], [4, 5], [9, 3001, 3001, 9], [9, 3001]])
+    for name in score_dtype.names:
+        assert doubled[name][0] == doubled[name][1] and doubled[name][2] == doubled[name][3]
+
+    # the same chords in saved form, in other slots, give the same scores
+    notes, counts = unique_chords(as_note_array([[[6, 1, 1], [4, 1, 2], [5, 1, 3]], [4, 5, 6], [4, 6]]))
+    assert notes.tolist() == [[6, 4, 0], [6, 5, 4]] and counts.tolist() == [1, 2]
+    assert np.allclose(score_chords(notes[1:])["roughness"], scores["roughness"][3])
@@ -18,3 +18,32 @@ def test_decomposition_into_primes():
     assert list(decompose_into_small_primes(12, primes)) == [2, 1, 0, 0]
     assert decompose_into_small_primes(13, primes) == None
     assert list(decompose_into_small_primes(14, primes)) == [1, 0, 0, 1]
+
+
+def test_undo_redo_of_chord_changes():
+    chords = [
+        [(4, 1, 1)],
+        [(4, 1, 1), (5, 1, 2)],
+        [(4, 1, 1), (5, 1, 2), (6, 0.5, 3)],
+        [(4, 1, 1), (5, 1.1, 2), (6, 0.5, 3)],
+        [(4, 1, 1), (7, 1, 4)],
+    ]
+    undo_handler = UndoHandler(chords[:2])
+    undo_handler.save(chords[2])
+    undo_handler.save(chords[2])
+    undo_handler.save(chords[3])
+    current = chords[4]
+    for expected in [chords[3], chords[2], chords[1]]:
+        current = undo_handler.undo(current)
+        assert sorted(current) == sorted(expected)
+    current = undo_handler.redo(current)
+    assert sorted(current) == sorted(chords[2])
+    whole_history = undo_handler.get_whole_histroy(current)
+    assert [sorted(chord) for chord in whole_history] == [sorted(chord) for chord in chords]
+
+
+def test_undo_history_is_bounded():
+    undo_handler = UndoHandler(max_steps=3)
+    for freq in range(1, 10):
+        undo_handler.save([(freq, 1, freq)])
+    assert undo_handler.get_whole_histroy([(10, 1, 10)]) == [[(7, 1, 7)], [(8, 1, 8)], [(9, 1, 9)], [(10, 1, 10)]]
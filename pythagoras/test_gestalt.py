@@ -0,0 +1,20 @@
+# tests for the harmonic gestalt analysis
+from gestalt import *
+
+
+def test_gestalts_of_a_chord():
+    analyzer = GestaltAnalyzer()
+    analyzer.set_chord([4, 5, 6, 11])
+    gestalts, affiliations = analyzer.get_gestalts()
+    assert gestalts == {1: {4, 5, 6}, 2: {4, 6}}
+    assert affiliations == {4: {1, 2}, 5: {1}, 6: {1, 2}}
+
+
+def test_incremental_updates_match_recomputing():
+    analyzer = GestaltAnalyzer()
+    analyzer.set_chord([4, 5, 6])
+    analyzer.set_chord([5, 6, 7, 9])
+    fresh = GestaltAnalyzer()
+    fresh.set_chord([9, 7, 6, 5])
+    assert analyzer.get_gestalts() == fresh.get_gestalts()
+    assert analyzer.get_gestalts()[0][3] == {6, 9}
@@ -0,0 +1,78 @@
+# tests for building the lattice
+import itertools
+
+import numpy as np
+
+from dashboard_helpers import decompose_into_small_primes
+from lattice import *
+
+
+def test_factorization_matches_decomposition():
+    primes = [2, 3, 5, 7]
+    numbers, exponents = factorize_up_to(500, primes)
+    expected = [n for n in range(1, 501) if decompose_into_small_primes(n, primes) is not None]
+    assert numbers.tolist() == expected
+    for n, n_exponents in zip(numbers, exponents):
+        assert list(n_exponents) == list(decompose_into_small_primes(n, primes))
+
+
+def test_ratio_edges_match_pairwise_search():
+    numbers, _ = factorize_up_to(300, [2, 3, 5])
+    for a, b in [(2, 1), (3, 2), (5, 3), (4, 2)]:
+        n1s, n2s = find_ratio_edges(numbers, a, b)
+        expected = [(n1, n2) for n1, n2 in itertools.product(numbers, numbers) if n2 / n1 == a / b]
+        assert sorted(zip(n1s.tolist(), n2s.tolist())) == sorted(expected)
+
+
+def test_spatial_grid_finds_nearest_point():
+    positions = np.array([[0.0, 0.0], [10.0, 10.0], [10.5, 10.0], [-3.0, 4.0]])
+    grid = SpatialGrid(positions, cell_size=2)
+    assert grid.find_nearest([0.5, 0.5], 1) == 0
+    assert grid.find_nearest([10.4, 10.1], 1) == 2
+    assert grid.find_nearest([-3.5, 3.5], 1) == 3
+    assert grid.find_nearest([5.0, 5.0], 1) is None
+
+
+def test_lattice_adjacency_matches_edges():
+    lattice = build_lattice(200, [2, 3, 5], [(2, 1), (3, 2), (5, 4)], avoid_numbers={125})
+    assert lattice.index(125) is None
+    assert lattice.index(7) is None
+    for i in range(len(lattice)):
+        neighbors, edges = lattice.neighbors_of(i)
+        for neighbor, edge in zip(neighbors, edges):
+            assert sorted(lattice.edge_nodes[edge]) == sorted([i, neighbor])
+    n = lattice.numbers[lattice.neighbors_of(lattice.index(12))[0]]
+    assert sorted(n.tolist()) == [6, 8, 15, 18, 24]
+
+
+def test_spatial_grid_finds_points_in_rect():
+    positions = np.random.default_rng(0).uniform(-50, 50, size=(1000, 2))
+    grid = SpatialGrid(positions, cell_size=3)
+    for low, high in [([-5, -5], [5, 10]), ([-100, -100], [100, 100]), ([60, 60], [70, 70])]:
+        inside = np.all((positions >= low) & (positions <= high), axis=1)
+        assert grid.find_in_rect(low, high).tolist() == np.flatnonzero(inside).tolist()
+
+
+def test_smallest_prime_factors():
+    spf = smallest_prime_factors(1000)
+    for n in range(2, 1001):
+        smallest = next(p for p in range(2, n + 1) if n % p == 0)
+        assert spf[n] == smallest
+    assert primes_up_to(13, spf) == [2, 3, 5, 7, 11, 13]
+    for n in range(1, 1001):
+        with_sieve = decompose_into_small_primes(n, [2, 3, 5, 7, 11], spf)
+        without_sieve = decompose_into_small_primes(n, [2, 3, 5, 7, 11])
+        assert (with_sieve is None and without_sieve is None) or list(with_sieve) == list(without_sieve)
+
+
+def test_lattice_save_and_load(tmp_path):
+    lattice = build_lattice(300, [2, 3, 5], [(2, 1), (3, 2)])
+    positions = np.random.default_rng(0).normal(size=(len(lattice), 2))
+    lattice.save(tmp_path / "lattice", positions=positions)
+    loaded, arrays = Lattice.load(tmp_path / "lattice")
+    assert np.array_equal(arrays["positions"], positions)
+    for i in range(len(lattice)):
+        assert loaded.neighbors_of(i)[0].tolist() == lattice.neighbors_of(i)[0].tolist()
+    assert loaded.index(12) == lattice.index(12)
+    loaded.active[loaded.index(12)] = True
+    assert not loaded.active_edges().any()
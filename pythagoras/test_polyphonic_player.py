@@ -0,0 +1,149 @@
+# tests for the synthesis, run without any audio device
+import numpy as np
+
+from polyphonic_player import *
+
+
+def test_offline_render_of_a_single_note():
+    player = PolyphonicPlayer(base_freq=10, master_volume=0.5, output_mode="offline")
+    player.set_chord([(44, 1, 7)])
+    sound = player.render_offline(0.3, block_duration=0.01)
+
+    ts = np.arange(len(sound)) / BIT_RATE
+    expected = 0.5 * human_corrected_amplitude(440) * np.sin(2 * np.pi * 440 * ts)
+    assert len(sound) == 3 * BIT_RATE // 10
+    # the note fades in, and then it's a plain sine
+    assert sound[0] == 0
+    assert np.allclose(sound[-4800:], expected[-4800:], atol=1e-5)
+    assert player.get_chord() == [(44, 1.0, 7)]
+
+
+def test_smoothing_doesnt_depend_on_block_size():
+    sounds = []
+    for block_duration in [0.01, 1.0]:
+        player = PolyphonicPlayer(output_mode="offline")
+        player.set_chord([(4, 1, 1), (5, 1, 2), (6, 1, 3)])
+        first_chord = player.render_offline(0.2, block_duration)
+        player.set_chord([(4, 1, 1), (15, 2, 2), (7, 1, 9)])
+        second_chord = player.render_offline(0.2, block_duration)
+        player.turn_off_all()
+        silence = player.render_offline(0.5, block_duration)
+        sounds.append(np.concatenate([first_chord, second_chord, silence]))
+
+        # released voices fade out and get dropped
+        assert player.get_chord() == []
+        assert player.bank.size == 0
+        assert np.all(np.abs(silence[-100:]) < 1e-5)
+    assert np.allclose(sounds[0], sounds[1], atol=1e-5)
+
+
+def test_removing_a_middle_voice_moves_the_last_one_into_its_slot():
+    bank = OscillatorBank(base_freq=10)
+    reference = OscillatorBank(base_freq=10)
+    for freq, voice_num in [(4, 1), (5, 2), (6, 3)]:
+        bank.add(freq, 1, 0, voice_num)
+        if voice_num != 2:
+            reference.add(freq, 1, 0, voice_num)
+    bank.render(480)
+    reference.render(480)
+    phase, glide_freq, gain = bank.phases[2], bank.glide_freqs[2], bank.gains[2]
+
+    bank.remove(1)
+    assert bank.size == 2
+    assert bank.find_voice(3) == 1 and bank.find_freq(6) == 1
+    assert bank.find_voice(2) is None and bank.find_freq(5) is None
+    assert (bank.freqs[1], bank.phases[1], bank.glide_freqs[1], bank.gains[1]) == (6, phase, glide_freq, gain)
+    assert sorted(bank.get_chord()) == [(4, 1.0, 1), (6, 1.0, 3)]
+    # the moved voice goes on exactly as if the removed one was never there
+    assert np.allclose(bank.render(480), reference.render(480))
+
+
+def test_ring_buffer_wraps_around():
+    ring = RingBuffer(10)
+    ring.write(np.arange(7, dtype=np.float32))
+    out = np.empty(5, dtype=np.float32)
+    assert ring.read_into(out) == 5 and out.tolist() == [0, 1, 2, 3, 4]
+    # the next write goes past the end of the buffer, and continues from its start
+    ring.write(np.arange(7, 13, dtype=np.float32))
+    assert ring.available() == 8 and ring.free() == 2
+    out = np.full(10, -1, dtype=np.float32)
+    # there are only 8 samples, the rest is silence
+    assert ring.read_into(out) == 8
+    assert out.tolist() == [5, 6, 7, 8, 9, 10, 11, 12, 0, 0]
+    assert ring.available() == 0
+
+
+def test_wavetable_matches_sines_and_drops_harmonics_above_nyquist():
+    phases = np.random.default_rng(0).uniform(0, 100, size=(2, 1000))
+    sine = Wavetable([1])
+    # linear interpolation of 2048 samples per period is off by at most (2 pi / 2048)**2 / 8
+    assert np.max(np.abs(sine.lookup(phases, np.array([100, 100])) - np.sin(phases))) < 2e-6
+
+    violin = Wavetable(timbres["violin"])
+    amplitudes = np.array(timbres["violin"])
+    # all the variants are scaled to the peak of the full one
+    angles = 2 * np.pi * np.arange(Wavetable.size) / Wavetable.size
+    scale = np.max(np.abs(amplitudes @ np.sin(np.multiply.outer(np.arange(1, 13), angles))))
+    # at 100 Hz all 12 harmonics fit below 24 kHz, at 8 kHz only 2 of them do
+    frequencies = np.array([100, 8000])
+    waves = violin.lookup(phases, frequencies)
+    for wave, voice_phases, num_harmonics in zip(waves, phases, [12, 2]):
+        harmonics = np.arange(1, num_harmonics + 1)
+        expected = amplitudes[:num_harmonics] @ np.sin(np.multiply.outer(harmonics, voice_phases)) / scale
+        assert np.max(np.abs(wave - expected)) < 1e-4
+
+
+def test_commands_are_applied_in_order_before_the_next_block():
+    player = PolyphonicPlayer(output_mode="offline")
+    player.set_chord([(4, 1, 1), (5, 1, 2), (6, 1, 3)])
+    player.move_note(5, new_freq=10, volume_change=0.5)
+    player.remove_note(6)
+    player.add_note(12)
+    # nothing is applied until the player thread gets to it
+    assert player.get_chord() == [] and player.get_stats()["queue_depth"] == 4
+    player.render_offline(0.01)
+    chord = sorted(player.get_chord())
+    assert [(freq, volume) for freq, volume, _ in chord] == [(4, 1.0), (10, 0.5), (12, 1.0)]
+    assert chord[1][2] == 2
+    assert player.bank.find_freq(5) is None and player.bank.find_voice(3) is None
+    assert player.bank.find_freq(10) == player.bank.find_voice(2)
+
+    # voices which stay in the new chord keep their slots and phases
+    slot, phase = player.bank.find_voice(1), player.bank.phases[player.bank.find_voice(1)]
+    player.set_chord([(4, 1, 1), (7, 1, 5)])
+    player.move_note(404, volume_change=2)  # no such note, ignored
+    player._apply_commands()
+    assert sorted(player.get_chord()) == [(4, 1.0, 1), (7, 1.0, 5)]
+    assert player.bank.find_voice(1) == slot and player.bank.phases[slot] == phase
+    player.turn_off_all()
+    player._apply_commands()
+    assert player.get_chord() == []
+
+
+def test_stats_show_no_voices_after_everything_faded_out():
+    player = PolyphonicPlayer(output_mode="offline")
+    player.set_chord([(4, 1, 1), (5, 1, 2)])
+    player.render_offline(0.1, block_duration=0.01)
+    stats = player.get_stats()
+    assert stats["active_voices"] == 2 and stats["peak_level"] > 0
+
+    player.turn_off_all()
+    player.render_offline(0.5, block_duration=0.01)
+    assert player.bank.size == 0
+    stats = player.get_stats()
+    assert stats["active_voices"] == 0 and stats["peak_level"] == 0.0
+    assert stats["max_peak_level"] > 0
+
+
+def test_offline_render_at_another_sample_rate_with_two_channels():
+    player = PolyphonicPlayer(
+        base_freq=10, master_volume=0.5, output_mode="offline", sample_rate=22050, channels=2
+    )
+    player.set_chord([(44, 1, 7)])
+    sound = player.render_offline(0.5, block_duration=0.02)
+
+    # still mono, and the pitch and duration follow the sample rate
+    assert sound.shape == (22050 // 2,)
+    ts = np.arange(len(sound)) / 22050
+    expected = 0.5 * human_corrected_amplitude(440) * np.sin(2 * np.pi * 440 * ts)
+    assert np.allclose(sound[-2205:], expected[-2205:], atol=1e-5)
@@ -0,0 +1,19 @@
+# tests for rendering saves to files, run without any audio device
+import wave
+
+from render import *
+
+
+def test_render_library_writes_a_wav_per_save(tmp_path):
+    saves = {
+        "first": {"a": [[4, 1, 1], [5, 1, 2]], "history": [[[6, 1, 1]]]},
+        "second": {"b": [[3, 1, 1]]},
+    }
+    results = render_library(saves, str(tmp_path), jobs=2, chord_duration=0.1, sample_rate=22050)
+    seconds = {save_name: seconds for save_name, seconds, _ in results}
+    assert seconds == {"first": 0.2, "second": 0.1}
+
+    for save_name, num_chords in [("first", 2), ("second", 1)]:
+        with wave.open(str(tmp_path / f"{save_name}.wav")) as f:
+            assert f.getframerate() == 22050
+            assert f.getnframes() == num_chords * 2205
@@ -0,0 +1,34 @@
+# tests for the session logger
+import csv
+
+from session_log import *
+
+
+def test_csv_log_rotates(tmp_path):
+    path = str(tmp_path / "ratios.csv")
+    logger = SessionLogger(path, batch_size=10, max_bytes=2000, backup_count=2)
+    for i in range(200):
+        logger.log("auto", [i % 100] + [0] * 9)
+    logger.close()
+    assert logger.dropped == 0
+    assert os.path.exists(f"{path}.1") and os.path.exists(f"{path}.2")
+    assert not os.path.exists(f"{path}.3")
+    rows = []
+    for log_path in [f"{path}.2", f"{path}.1", path]:
+        with open(log_path) as f:
+            rows += list(csv.reader(f))
+    # the oldest rows are gone
+    assert 0 < len(rows) < 200
+    assert rows[-1][1:] == ["auto", "99"] + ["0"] * 9
+
+
+def test_binary_log(tmp_path):
+    path = str(tmp_path / "ratios.bin")
+    logger = SessionLogger(path, format="binary")
+    logger.log("node", [4, 5, 6, 0, 0, 0, 0, 0, 0, 0])
+    logger.log("edge", [4, 5, 7, 0, 0, 0, 0, 0, 0, 0])
+    logger.close()
+    rows = load_binary_log(path)
+    assert os.path.getsize(path) == 2 * 19
+    assert [kinds[kind] for kind in rows["kind"]] == ["node", "edge"]
+    assert rows["ratios"][1].tolist() == [4, 5, 7, 0, 0, 0, 0, 0, 0, 0]
@@ -0,0 +1,84 @@
+# tests for the storage backends
+import json
+
+from storage import *
+
+
+def test_log_keeps_changes_across_runs(tmp_path):
+    backend = LogBackend(tmp_path / "saves.log", import_from=None)
+    backend.update("first", "a", [[4, 1, 1], [5, 1, 2]])
+    backend.update("second", "a", [[3, 1, 1]])
+    backend.update("first", "a", [[6, 1, 3]])
+    backend.update("first", "history", [[[4, 1, 1]]])
+    backend.close()
+
+    backend = LogBackend(tmp_path / "saves.log", import_from=None)
+    assert backend.load("first") == {"a": [[6, 1, 3]], "history": [[[4, 1, 1]]]}
+    assert backend.load("second") == {"a": [[3, 1, 1]]}
+    assert backend.load("third") is None
+    assert sorted(backend.names()) == ["first", "second"]
+    backend.close()
+
+
+def test_log_imports_json_lines_and_compacts(tmp_path):
+    saves = {f"save-{i}": {"a": [[i + 1, 1, 1]]} for i in range(1000)}
+    with open(tmp_path / "saved_chords.txt", "w") as f:
+        for save_name, save in saves.items():
+            f.write(json.dumps({save_name: save}) + "\n")
+    backend = LogBackend(tmp_path / "saves.log", import_from=tmp_path / "saved_chords.txt")
+    for i in range(2500):
+        backend.update("save-7", "b", [[i + 1, 1, 1]])
+    backend.close()
+
+    # reopening finds a lot of stale records, so compacts in the background
+    backend = LogBackend(tmp_path / "saves.log", import_from=None)
+    backend.update("save-8", "b", [[2, 1, 1]])
+    backend.compaction.join()
+    assert backend.load("save-7") == {"a": [[8, 1, 1]], "b": [[2500, 1, 1]]}
+    assert backend.load("save-8") == {"a": [[9, 1, 1]], "b": [[2, 1, 1]]}
+    assert len(backend.names()) == 1000
+    backend.close()
+    with open(tmp_path / "saves.log") as f:
+        # the new record is either in the compacted save-8 or after it
+        assert len(f.readlines()) in [1000, 1001]
+
+
+def test_sqlite_queries(tmp_path):
+    backend = SqliteBackend(tmp_path / "saves.sqlite")
+    backend.update("low", "a", [[4, 1, 1], [7, 1, 2]])
+    backend.update("low", "history", [[[4, 1, 1]], [[4, 1, 1], [5, 0.5, 3]]])
+    backend.update("high", "a", [[8, 1, 1], [14, 1, 2], [100, 1, 3]])
+    backend.update("high", "a", [[16, 1, 1], [28, 1, 2], [100, 1, 3]])
+    assert backend.load("low") == {
+        "a": [[4, 1, 1], [7, 1, 2]],
+        "history": [[[4, 1, 1]], [[4, 1, 1], [5, 0.5, 3]]],
+    }
+    assert backend.load("high") == {"a": [[16, 1, 1], [28, 1, 2], [100, 1, 3]]}
+
+    assert backend.chords_with_ratio(7, 4) == [("low", "a", None, [4, 7]), ("high", "a", None, [16, 28, 100])]
+    assert backend.chords_with_ratio(10, 8) == [("low", "history", 1, [4, 5])]
+    assert backend.chords_with_notes([5, 4]) == [("low", "history", 1, [4, 5])]
+    assert backend.saves_with_notes_up_to(64) == ["low"]
+    backend.close()
+
+
+class CollidingLogBackend(LogBackend):
+    # every name gets the same hash
+    _hash = staticmethod(lambda save_name: 12345)
+
+
+def test_log_tells_apart_saves_with_the_same_hash(tmp_path):
+    backend = CollidingLogBackend(tmp_path / "saves.log", import_from=None)
+    for i in range(5):
+        backend.update(f"save-{i}", "a", [[i + 1, 1, 1]])
+    backend.update("save-2", "b", [[7, 1, 1]])
+    backend.close()
+
+    backend = CollidingLogBackend(tmp_path / "saves.log", import_from=None)
+    assert sorted(backend.names()) == [f"save-{i}" for i in range(5)]
+    assert backend.load("save-2") == {"a": [[3, 1, 1]], "b": [[7, 1, 1]]}
+    assert backend.load("save-4") == {"a": [[5, 1, 1]]}
+    assert "save-5" not in backend
+    backend.compact()
+    assert backend.load("save-0") == {"a": [[1, 1, 1]]}
+    backend.close()